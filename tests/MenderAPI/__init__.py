@@ -29,11 +29,14 @@ def get_container_manager():
 
 from .artifacts import Artifacts
 from .authentication import Authentication
-from .deployments import Deployments
+from .deployments import Deployments, check_expected_statistics_many
 from .devauth import DeviceAuthV2
 from .deviceconnect import DeviceConnect
 from .inventory import Inventory
 from .devicemonitor import DeviceMonitor
+from .requests_helpers import reset_sessions, response_cache
+
+from testutils.api import client as api_client
 
 auth = Authentication()
 devauth = DeviceAuthV2(auth)
@@ -50,7 +53,11 @@ def set_container_manager(manager):
     container_manager = manager
 
 
-def reset_mender_api(manager=None):
+def reset_mender_api(manager=None, pool_size=None):
+    # The sessions of the previous environment would keep their
+    # connections to its (now gone) gateway open for the whole run
+    reset_sessions(pool_size)
+    api_client.reset_sessions()
     auth.reset()
     devauth.reset()
     devconnect.reset()
@@ -58,6 +65,7 @@ def reset_mender_api(manager=None):
     image.reset()
     inv.reset()
     devmonitor.reset()
+    response_cache.clear()
     set_container_manager(manager)
 
 
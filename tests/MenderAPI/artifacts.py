@@ -12,11 +12,120 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import functools
+import hashlib
+import json
 import os
 import shutil
 import subprocess
 
+import filelock
+
 from . import logger
+from testutils.util.debugfs import DebugfsSession
+from testutils.util.images import file_digest
+
+# Artifacts built from identical inputs are cached here, up to this many bytes
+# (0 disables the cache)
+ARTIFACT_CACHE_PATH = os.getenv("MENDER_ARTIFACT_CACHE", ".artifact_cache")
+ARTIFACT_CACHE_SIZE = int(
+    os.getenv("MENDER_ARTIFACT_CACHE_SIZE", str(4 * 1024 * 1024 * 1024))
+)
+
+MENDER_CONF_PATH = "/etc/mender/mender.conf"
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool):
+    return subprocess.check_output([tool, "--version"]).decode().strip()
+
+
+class ArtifactCache:
+    """Content-addressed cache of the artifacts, keyed by a hash of all the
+    inputs of mender-artifact, including the digests of the input files.
+
+    Entries are built and fetched under a per-entry file lock, so that it is
+    safe to share between xdist workers, and the least recently used ones are
+    evicted past the size limit. An entry built with another artifact name
+    is reused, only renaming the artifact, as long as the renamed artifact
+    reads back like a fresh build would."""
+
+    def __init__(self, path=ARTIFACT_CACHE_PATH, max_size=ARTIFACT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def enabled(self):
+        return self.max_size > 0
+
+    def key(self, inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def get_or_build(self, inputs, artifact_name, artifact_filename, build, rename):
+        """Copies the cached artifact to artifact_filename, renaming it with
+        rename(cached_name) if it was built with another name. On a miss, or
+        if rename() returns False, build() writes artifact_filename, which is
+        then cached."""
+        os.makedirs(self.path, exist_ok=True)
+        entry = os.path.join(self.path, self.key(inputs))
+        with filelock.FileLock(entry + ".lock"):
+            if os.path.exists(entry + ".mender"):
+                with open(entry + ".json") as f:
+                    meta = json.load(f)
+                cached_name = meta["artifact_name"]
+                if cached_name == artifact_name or meta.get("renamable", True):
+                    shutil.copyfile(entry + ".mender", artifact_filename)
+                    os.utime(entry + ".mender")
+                    logger.info(
+                        "Artifact cache hit for %s (built as %s)"
+                        % (artifact_filename, cached_name)
+                    )
+                    if cached_name == artifact_name or rename(cached_name):
+                        return
+                    # Don't try to rename this one again
+                    logger.info("Renamed artifact differs from a build, building it")
+                    with open(entry + ".json", "w") as f:
+                        json.dump(dict(meta, renamable=False), f)
+                build()
+                return
+
+            build()
+            if os.path.getsize(artifact_filename) > self.max_size:
+                return
+            with open(entry + ".json", "w") as f:
+                json.dump({"artifact_name": artifact_name, "inputs": inputs}, f)
+            tmp = "%s.%d.tmp" % (entry, os.getpid())
+            shutil.copyfile(artifact_filename, tmp)
+            os.replace(tmp, entry + ".mender")
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries past the size limit,
+        skipping the ones being used."""
+        with filelock.FileLock(os.path.join(self.path, "evict.lock")):
+            entries = []
+            for name in os.listdir(self.path):
+                if name.endswith(".mender"):
+                    st = os.stat(os.path.join(self.path, name))
+                    entries.append((st.st_mtime, st.st_size, name[: -len(".mender")]))
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_size:
+                    break
+                entry = os.path.join(self.path, key)
+                try:
+                    with filelock.FileLock(entry + ".lock", timeout=0):
+                        os.remove(entry + ".mender")
+                        os.remove(entry + ".json")
+                        # A process waiting on the lock meanwhile might end up
+                        # building the entry again, which is harmless
+                        os.remove(entry + ".lock")
+                except filelock.Timeout:
+                    continue
+                logger.info("Evicted artifact %s from the cache" % key)
+                total -= size
+
+
+artifact_cache = ArtifactCache()
 
 
 class Artifacts:
@@ -68,8 +177,23 @@ class Artifacts:
         for key, value in provides.items():
             cmd += " -p %s:%s" % (key, value)
 
-        logger.info("Running: " + cmd)
-        subprocess.check_call(cmd, shell=True)
+        inputs = {
+            "type": "rootfs-image",
+            "image": file_digest(image),
+            "device_type": device_type,
+            "scripts": [(os.path.basename(s), file_digest(s)) for s in scripts],
+        }
+        self._write(
+            cmd,
+            inputs,
+            artifact_name,
+            artifact_filename,
+            signed_arg,
+            global_flags=global_flags,
+            version=version,
+            depends=depends,
+            provides=provides,
+        )
 
         return artifact_filename
 
@@ -121,52 +245,104 @@ class Artifacts:
         for key, value in provides.items():
             cmd += " -p %s:%s" % (key, value)
 
-        logger.info("Running: " + cmd)
-        subprocess.check_call(cmd, shell=True)
+        inputs = {
+            "type": module_type,
+            "device_type": device_type,
+            "files": [(os.path.basename(f), file_digest(f)) for f in files],
+            "meta_data": file_digest(meta_data) if meta_data else None,
+            "scripts": [(os.path.basename(s), file_digest(s)) for s in scripts],
+        }
+        self._write(
+            cmd,
+            inputs,
+            artifact_name,
+            artifact_filename,
+            signed_arg,
+            global_flags=global_flags,
+            version=version,
+            depends=depends,
+            provides=provides,
+        )
 
         return artifact_filename
 
-    def get_mender_conf(self, image):
-        """
-        Get the /etc/mender/mender.conf from the artifact rootfs as a
-        python dictionary.
-        """
-        conf = {}
+    def _write(
+        self, cmd, inputs, artifact_name, artifact_filename, signed_arg, **options
+    ):
+        """Runs the mender-artifact write command, unless an artifact with
+        the same inputs is in the cache."""
 
-        output = subprocess.check_output(
-            "debugfs -R 'cat /etc/mender/mender.conf' " + "%s" % image,
-            shell=True,
-        ).decode()
-        import json
+        def build():
+            logger.info("Running: " + cmd)
+            subprocess.check_call(cmd, shell=True)
 
-        conf = json.loads(output)
+        if not artifact_cache.enabled():
+            build()
+            return
 
-        return conf
+        def rename(cached_name):
+            rename_cmd = "%s modify -n %s %s %s" % (
+                self.artifacts_tool_path,
+                artifact_name,
+                signed_arg,
+                artifact_filename,
+            )
+            logger.info("Running: " + rename_cmd)
+            if subprocess.call(rename_cmd, shell=True) != 0:
+                return False
+            return self._renamed_as_built(artifact_filename, artifact_name, cached_name)
 
-    def replace_mender_conf(self, image, conf):
+        signing_key = signed_arg.split()[-1] if signed_arg else None
+        inputs = dict(
+            inputs,
+            tool=tool_version(self.artifacts_tool_path),
+            signing_key=file_digest(signing_key) if signing_key else None,
+            **options,
+        )
+        artifact_cache.get_or_build(
+            inputs, artifact_name, artifact_filename, build, rename
+        )
+
+    def _renamed_as_built(self, artifact_filename, artifact_name, cached_name):
+        """Whether the renamed artifact reads back as a build with the new
+        name would: read verifies the checksums of the payloads, and the old
+        name must not be left anywhere, e.g. in rootfs-image.version."""
+        r = subprocess.run(
+            [self.artifacts_tool_path, "read", artifact_filename],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        output = r.stdout.decode(errors="replace")
+        if r.returncode != 0:
+            logger.info("Renamed artifact is not valid:\n%s" % output)
+            return False
+        names = [
+            line.split(":", 1)[1].strip()
+            for line in output.splitlines()
+            if line.strip().startswith("Name:")
+        ]
+        if names[:1] != [artifact_name] or cached_name in output:
+            logger.info(
+                "Renamed artifact still refers to %s:\n%s" % (cached_name, output)
+            )
+            return False
+        return True
+
+    def get_mender_conf(self, image):
         """
         Get the /etc/mender/mender.conf from the artifact rootfs as a
         python dictionary.
         """
-        tmp_conf_dir = os.path.join(os.path.curdir, "tmp_conf")
-        try:
-            os.mkdir(tmp_conf_dir)
-            tmp_conf_path = os.path.join(tmp_conf_dir, "mender.conf")
-            import json
-
-            with open(tmp_conf_path, "w") as f:
-                json.dump(conf, f, indent=2, sort_keys=True)
-            debugfs_cmd = (
-                "cd /etc/mender/\n"
-                + "rm mender.conf\n"
-                + "write %s mender.conf\n" % tmp_conf_path
-                + "close\n"
-            )
+        fs = DebugfsSession(image)
+        fs.read(MENDER_CONF_PATH)
+        return json.loads(fs.run()[MENDER_CONF_PATH])
 
-            cmd = "cat << EOF | debugfs -w %s\n%sEOF\n" % (image, debugfs_cmd)
-            retcode = subprocess.call(cmd, shell=True)
-            if retcode != 0:
-                logger.fatal("debugfs returned status code: %s." % retcode)
-        finally:
-            shutil.rmtree(tmp_conf_dir)
+    def replace_mender_conf(self, image, conf):
+        """
+        Replace the /etc/mender/mender.conf of the artifact rootfs with the
+        given python dictionary.
+        """
+        fs = DebugfsSession(image, writable=True)
+        fs.write(MENDER_CONF_PATH, json.dumps(conf, indent=2, sort_keys=True))
+        fs.run()
         return conf
@@ -12,17 +12,136 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import base64
+import hashlib
 import json
+import os
 import time
+
+import filelock
 from requests.auth import HTTPBasicAuth
 
 from . import logger
 from . import api_version
 from . import get_container_manager
-from .requests_helpers import requests_retry
+from .requests_helpers import requests_retry, response_hooks
+from .waiters import wait_until
 
 from testutils.infra.cli import CliUseradm, CliTenantadm
 
+# Tokens are refreshed when they have less than this many seconds left
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+
+def token_expiry(token):
+    """Returns the exp claim of the JWT, or None if it has none."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return claims.get("exp")
+    except (IndexError, ValueError):
+        return None
+
+
+class TokenCache:
+    """JWTs of the users, by environment, tenant and user, in a JSON file
+    shared by the xdist workers, so that they are only logged in once for
+    as long as their tokens are valid.
+
+    The environment is the compose project along with the time it was
+    (re)created, since a new environment comes with a new user database and
+    signing key. Tokens rejected with a 401 are evicted, see response_hook.
+    """
+
+    def __init__(self, path=os.getenv("MENDER_AUTH_TOKEN_CACHE", ".auth_tokens.json")):
+        self.path = path
+        self.lock = filelock.FileLock(path + ".lock")
+        # Tokens evicted by this process, which the in-memory headers of the
+        # Authentication objects must not be used with anymore
+        self.evicted = set()
+
+    @staticmethod
+    def key(environment, tenant, username, password):
+        # The password is part of the key, so that a wrong password is
+        # never served a token
+        digest = hashlib.sha256(password.encode()).hexdigest()[:16]
+        return "%s/%s/%s/%s" % (environment, tenant, username, digest)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _update(self, update):
+        """Applies update() to the cached tokens, dropping the expired ones
+        on the way, and writes them back."""
+        with self.lock:
+            now = time.time()
+            tokens = {
+                k: t
+                for k, t in self._load().items()
+                if token_expiry(t) is None or token_expiry(t) > now
+            }
+            update(tokens)
+            tmp = "%s.%d" % (self.path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(tokens, f)
+            os.replace(tmp, self.path)
+
+    def get(self, key):
+        """Returns the cached token, unless it is about to expire."""
+        with self.lock:
+            token = self._load().get(key)
+        if token is None or token in self.evicted:
+            return None
+        exp = token_expiry(token)
+        if exp is not None and exp - time.time() < TOKEN_REFRESH_MARGIN:
+            return None
+        return token
+
+    def put(self, key, token):
+        self.evicted.discard(token)
+        self._update(lambda tokens: tokens.update({key: token}))
+
+    def evict(self, key=None, token=None):
+        """Removes the entry with the given key, and the ones with the given
+        token."""
+        if token is not None:
+            self.evicted.add(token)
+
+        def remove(tokens):
+            for k, t in list(tokens.items()):
+                if k == key or t == token:
+                    del tokens[k]
+
+        self._update(remove)
+
+    def response_hook(self, r, *args, **kwargs):
+        """requests response hook evicting the bearer tokens rejected by the
+        backend."""
+        if r.status_code != 401:
+            return
+        header = r.request.headers.get("Authorization", "")
+        if header.startswith("Bearer "):
+            token = header[len("Bearer ") :]
+            if token not in self.evicted:
+                self.evict(token=token)
+
+
+token_cache = TokenCache()
+response_hooks.append(token_cache.response_hook)
+
+
+def _environment():
+    manager = get_container_manager()
+    if manager is None:
+        return ""
+    return "%s@%s" % (manager.name, getattr(manager, "started_at", None) or "")
+
 
 class Authentication:
     auth_header = None
@@ -66,10 +185,23 @@ class Authentication:
         self.username = username
         self.password = password
         self.plan = plan
-        self.get_auth_token()
+        # The org is created (and current_tenant set) on a failed login only,
+        # which a cached token would skip
+        self.get_auth_token(use_cache=False)
 
-    def get_auth_token(self, create_new_user=True):
-        if self.auth_header is not None:
+    def get_auth_token(self, create_new_user=True, use_cache=True):
+        if self.auth_header is not None and not self._token_expiring():
+            return self.auth_header
+        self.auth_header = None
+
+        key = self._cache_key()
+        token = token_cache.get(key) if use_cache else None
+        if token is not None:
+            logger.info(
+                "Using cached authentication token for user %s@%s"
+                % (self.username, self.org_name)
+            )
+            self.auth_header = {"Authorization": "Bearer " + token}
             return self.auth_header
 
         # try login - the user might be in a shared db
@@ -102,15 +234,17 @@ class Authentication:
                 else:
                     self.create_user(self.username, self.password)
 
-            # It might take some time for create_org to propagate the new user.
-            # Retry login for a minute.
-            for _ in range(60):
-                r = self._do_login(self.username, self.password)
-                if r.status_code == 200:
-                    break
-                time.sleep(1)
+                # It might take some time for create_org to propagate the new
+                # user. Retry login for a minute.
+                r = wait_until(
+                    lambda: self._do_login(self.username, self.password),
+                    lambda r: r.status_code == 200,
+                    60,
+                ).value
             assert r.status_code == 200
 
+        if self.auth_header is not None:
+            token_cache.put(key, r.text)
         return self.auth_header
 
     def create_user(self, username, password, tenant_id=""):
@@ -122,7 +256,28 @@ class Authentication:
         return self.current_tenant["tenant_id"]
 
     def reset_auth_token(self):
+        """Forgets the token of the user, in memory and in the token cache,
+        so that the next get_auth_token() logs in again."""
+        token = None
+        if self.auth_header is not None:
+            token = self.auth_header["Authorization"][len("Bearer ") :]
         self.auth_header = None
+        token_cache.evict(key=self._cache_key(), token=token)
+
+    def _cache_key(self):
+        return TokenCache.key(
+            _environment(),
+            self.org_name if self.multitenancy else "",
+            self.username,
+            self.password,
+        )
+
+    def _token_expiring(self):
+        token = self.auth_header["Authorization"][len("Bearer ") :]
+        if token in token_cache.evicted:
+            return True
+        exp = token_expiry(token)
+        return exp is not None and exp - time.time() < TOKEN_REFRESH_MARGIN
 
     def _do_login(self, username, password):
         r = requests_retry().post(
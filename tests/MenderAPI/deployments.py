@@ -12,16 +12,35 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import contextlib
+import functools
 import time
 import json
 import os
 import requests
 import pytest
 
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .. import log
 from . import logger
 from . import api_version
 from . import get_container_manager
-from .requests_helpers import requests_retry
+from .requests_helpers import (
+    MultipartFileBody,
+    StreamingBody,
+    requests_retry,
+    response_cache,
+)
+from .waiters import wait_for_conditions, wait_until
+
+# Deployment logs are downloaded this many bytes at a time
+LOG_CHUNK_SIZE = 64 * 1024
+# Deployment logs kept per device when a deployment unexpectedly fails
+LOG_MAX_BYTES = 10 * 1024 * 1024
+# Size of the end of each log quoted in the failure message
+LOG_TAIL_BYTES = 1024
 
 
 class Deployments:
@@ -46,19 +65,17 @@ class Deployments:
     def upload_image(self, filename, description="abc"):
         image_path_url = self.get_deployments_base_path() + "artifacts"
 
-        r = requests_retry().post(
-            image_path_url,
-            verify=False,
-            headers=self.auth.get_auth_token(),
-            files=(
-                ("description", (None, description)),
-                ("size", (None, str(os.path.getsize(filename)))),
-                (
-                    "artifact",
-                    (filename, open(filename, "rb"), "application/octet-stream"),
-                ),
-            ),
-        )
+        with MultipartFileBody(
+            [("description", description), ("size", os.path.getsize(filename))],
+            "artifact",
+            filename,
+            description="upload of %s" % filename,
+        ) as body:
+            headers = {"Content-Type": body.content_type}
+            headers.update(self.auth.get_auth_token())
+            r = requests_retry().post(
+                image_path_url, verify=False, headers=headers, data=body
+            )
 
         logger.info(
             "Received image upload status code: "
@@ -69,6 +86,62 @@ class Deployments:
         assert r.status_code == requests.status_codes.codes.created
         return r.headers["location"]
 
+    def direct_upload_image(self, filename):
+        """Uploads the artifact straight to the storage backend through a
+        pre-signed link, instead of through the deployments service.
+        Returns the ID of the artifact."""
+        r = requests_retry().post(
+            self.get_deployments_base_path() + "artifacts/directupload",
+            verify=False,
+            headers=self.auth.get_auth_token(),
+        )
+        assert r.status_code == requests.status_codes.codes.ok, r.text
+        link = r.json()
+
+        # The link points to the storage host behind the API gateway, which
+        # is not resolvable from here: connect to the gateway, and keep the
+        # original Host header for the signature to match.
+        uri = urlparse(link["uri"])
+        headers = {"Host": uri.netloc, "Content-Type": "application/octet-stream"}
+        headers.update(link.get("header") or {})
+        with StreamingBody(
+            [filename], description="direct upload of %s" % filename
+        ) as body:
+            r = requests_retry().put(
+                uri._replace(
+                    netloc=get_container_manager().get_mender_gateway()
+                ).geturl(),
+                verify=False,
+                headers=headers,
+                data=body,
+            )
+        assert r.ok, "Unexpected status %d: %s" % (r.status_code, r.text)
+
+        r = requests_retry().post(
+            self.get_deployments_base_path()
+            + "artifacts/directupload/%s/complete" % link["id"],
+            verify=False,
+            headers=self.auth.get_auth_token(),
+        )
+        assert r.status_code == requests.status_codes.codes.accepted, r.text
+        logger.info("artifact [%s] uploaded directly to the storage" % link["id"])
+
+        # The artifact is processed in the background once the upload is
+        # complete, and can't be deployed before it shows up
+        artifact_url = self.get_deployments_base_path() + "artifacts/%s" % link["id"]
+        result = wait_until(
+            lambda: requests_retry()
+            .get(artifact_url, verify=False, headers=self.auth.get_auth_token())
+            .status_code,
+            lambda status: status == requests.status_codes.codes.ok,
+            max_wait=60,
+        )
+        assert result.ok, "artifact [%s] not processed after %.1fs" % (
+            link["id"],
+            result.elapsed,
+        )
+        return link["id"]
+
     def trigger_deployment(
         self,
         name,
@@ -111,29 +184,46 @@ class Deployments:
 
         return deployment_id
 
-    def get_logs(
-        self, device, deployment_id, expected_status=200, n_tries=1, poll_gap=1
+    def _get_logs_response(
+        self,
+        device,
+        deployment_id,
+        expected_status=200,
+        n_tries=1,
+        poll_gap=1,
+        stream=False,
+        start=0,
     ):
+        deployments_logs_url = (
+            self.get_deployments_base_path()
+            + "deployments/%s/devices/%s/log" % (deployment_id, device)
+        )
+        headers = self.auth.get_auth_token()
+        if start > 0:
+            headers = {**headers, "Range": "bytes=%d-" % start}
+        accepted = [expected_status]
+        if start > 0 and expected_status == requests.status_codes.codes.ok:
+            accepted.append(requests.status_codes.codes.partial_content)
         while n_tries > 0:
             n_tries -= 1
-            deployments_logs_url = (
-                self.get_deployments_base_path()
-                + "deployments/%s/devices/%s/log"
-                % (
-                    deployment_id,
-                    device,
-                )
-            )
             r = requests_retry().get(
-                deployments_logs_url, headers=self.auth.get_auth_token(), verify=False
+                deployments_logs_url, headers=headers, verify=False, stream=stream
             )
-            if r.status_code == expected_status:
+            if r.status_code in accepted:
                 break
-            else:
-                time.sleep(poll_gap)
+            r.close()
+            time.sleep(poll_gap)
         assert (
-            r.status_code == expected_status
+            r.status_code in accepted
         ), f"Unexpected status {r.status_code} (after {n_tries} tries)"
+        return r
+
+    def get_logs(
+        self, device, deployment_id, expected_status=200, n_tries=1, poll_gap=1
+    ):
+        r = self._get_logs_response(
+            device, deployment_id, expected_status, n_tries, poll_gap
+        )
 
         if len(r.text) > 2048:
             logger.info("Long logs from the device, skipped in the test logs")
@@ -142,60 +232,122 @@ class Deployments:
 
         return r.text
 
+    def iter_logs(
+        self,
+        device,
+        deployment_id,
+        lines=True,
+        start=0,
+        chunk_size=LOG_CHUNK_SIZE,
+        n_tries=1,
+        poll_gap=1,
+    ):
+        """Streams the deployment log of the device, starting at byte start,
+        yielding decoded lines (or raw chunks if lines is False). The log is
+        never held in memory as a whole, and the download stops as soon as
+        the caller stops iterating."""
+        with self._get_logs_response(
+            device, deployment_id, 200, n_tries, poll_gap, stream=True, start=start
+        ) as r:
+            # The server may not honor the range, skip the head ourselves.
+            skip = start if r.status_code == requests.status_codes.codes.ok else 0
+            rest = b""
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if skip > 0:
+                    chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                    if not chunk:
+                        continue
+                if not lines:
+                    yield chunk
+                    continue
+                chunk_lines = (rest + chunk).split(b"\n")
+                rest = chunk_lines.pop()
+                for line in chunk_lines:
+                    yield line.decode(errors="replace")
+            if lines and rest:
+                yield rest.decode(errors="replace")
+
+    def find_in_logs(self, device, deployment_id, match, n_tries=1, poll_gap=1):
+        """Returns the first line of the deployment log of the device which
+        contains match (or for which match(line) is true, if callable), or
+        None. The rest of the log is not downloaded."""
+        if not callable(match):
+            pattern = match
+            match = lambda line: pattern in line
+        with contextlib.closing(
+            self.iter_logs(device, deployment_id, n_tries=n_tries, poll_gap=poll_gap)
+        ) as lines:
+            for line in lines:
+                if match(line):
+                    logger.info("found in the deployment logs: %s" % line[:2048])
+                    return line
+        logger.info("no match in the deployment logs of device %s" % device)
+        return None
+
     def get_status(self, status=None):
         deployments_status_url = self.get_deployments_base_path() + "deployments"
 
         if status:
             deployments_status_url += "?status=%s" % (status)
 
-        r = requests_retry().get(
-            deployments_status_url, headers=self.auth.get_auth_token(), verify=False
+        r, data, _ = response_cache.get_json(
+            deployments_status_url, headers=self.auth.get_auth_token()
         )
 
         assert r.status_code == requests.status_codes.codes.ok
-        return json.loads(r.text)
+        return data
 
     def get_statistics(self, deployment_id):
         deployments_statistics_url = (
             self.get_deployments_base_path()
             + "deployments/%s/statistics" % (deployment_id)
         )
-        r = requests_retry().get(
-            deployments_statistics_url, headers=self.auth.get_auth_token(), verify=False
+        r, data, changed = response_cache.get_json(
+            deployments_statistics_url, headers=self.auth.get_auth_token()
         )
         assert r.status_code == requests.status_codes.codes.ok
 
-        try:
-            json.loads(r.text)
-        except Exception as e:
-            assert e is None
-
-        if not self.last_statistic.setdefault(deployment_id, []) or self.last_statistic[
-            deployment_id
-        ][-1] != str(r.text):
+        if changed and (
+            not self.last_statistic.setdefault(deployment_id, [])
+            or self.last_statistic[deployment_id][-1] != str(r.text)
+        ):
             self.last_statistic[deployment_id].append(str(r.text))
             logger.info("Statistics contains new entry: " + str(r.text))
 
-        return json.loads(r.text)
+        return data
+
+    def wait_for_deployment(
+        self, deployment_id, condition, max_wait=10 * 60, polling_frequency=0.2
+    ):
+        """Polls the deployment by ID, with jittered exponential backoff
+        starting at polling_frequency, until condition(deployment) holds or
+        max_wait seconds have passed. Returns a WaitResult."""
+
+        def poll():
+            r, data, _ = response_cache.get_json(
+                self.get_deployments_base_path() + "deployments/%s" % (deployment_id),
+                headers=self.auth.get_auth_token(),
+            )
+            assert r.status_code == requests.status_codes.codes.ok
+            return data
+
+        return wait_until(poll, condition, max_wait, initial=polling_frequency)
 
     def check_expected_status(
         self, expected_status, deployment_id, max_wait=10 * 60, polling_frequency=0.2
     ):
-        timeout = time.time() + max_wait
-
-        while time.time() <= timeout:
-            data = self.get_status(status=expected_status)
-
-            for deployment in data:
-                if deployment["id"] == deployment_id:
-                    logger.info(
-                        "got expected deployment status (%s) for: %s"
-                        % (expected_status, deployment_id)
-                    )
-                    return
-            else:
-                time.sleep(polling_frequency)
-                continue
+        result = self.wait_for_deployment(
+            deployment_id,
+            lambda deployment: deployment["status"] == expected_status,
+            max_wait=max_wait,
+            polling_frequency=polling_frequency,
+        )
+        if result.ok:
+            logger.info(
+                "got expected deployment status (%s) for: %s after %.1fs and %d polls"
+                % (expected_status, deployment_id, result.elapsed, result.polls)
+            )
+            return result
 
         pytest.fail(
             "Never found status: %s for %s after %d seconds"
@@ -205,19 +357,18 @@ class Deployments:
     def check_not_in_status(
         self, expected_status, deployment_id, max_wait=10 * 60, polling_frequency=0.2
     ):
-        timeout = time.time() + max_wait
-
-        while time.time() <= timeout:
-            data = self.get_status(status=expected_status)
-
-            found = any(d["id"] == deployment_id for d in data)
-            if not found:
-                logger.info(
-                    "left deployment status (%s) as expected for: %s"
-                    % (expected_status, deployment_id)
-                )
-                return
-            time.sleep(polling_frequency)
+        result = self.wait_for_deployment(
+            deployment_id,
+            lambda deployment: deployment["status"] != expected_status,
+            max_wait=max_wait,
+            polling_frequency=polling_frequency,
+        )
+        if result.ok:
+            logger.info(
+                "left deployment status (%s) as expected for: %s after %.1fs and %d polls"
+                % (expected_status, deployment_id, result.elapsed, result.polls)
+            )
+            return result
 
         pytest.fail(
             "Never left status: %s for %s after %d seconds"
@@ -240,19 +391,7 @@ class Deployments:
             seen.add(str(data))
 
             if int(data["failure"]) > 0 and expected_status != "failure":
-                all_failed_logs = ""
-                for device in self.devauth.get_devices():
-                    try:
-                        all_failed_logs += (
-                            self.get_logs(device["id"], deployment_id) + "\n" * 5
-                        )
-                    except Exception:
-                        logger.warning("failed to get logs.")
-
-                pytest.fail(
-                    "deployment unexpectedly failed, here are the deployment logs: \n\n %s"
-                    % (all_failed_logs)
-                )
+                self.fail_with_logs(deployment_id)
 
             if data[expected_status] == expected_count:
                 return
@@ -263,6 +402,59 @@ class Deployments:
             % (expected_status, expected_count, str(seen), max_wait)
         )
 
+    def save_logs(self, device, deployment_id, filename, max_bytes=None):
+        """Streams the deployment log of the device into filename, keeping at
+        most max_bytes of it. Returns (bytes written, whether truncated)."""
+        written = 0
+        truncated = False
+        with open(filename, "wb") as f:
+            for chunk in self.iter_logs(device, deployment_id, lines=False):
+                if max_bytes is not None and written + len(chunk) > max_bytes:
+                    chunk = chunk[: max_bytes - written]
+                    truncated = True
+                f.write(chunk)
+                written += len(chunk)
+                if truncated:
+                    break
+        return written, truncated
+
+    def fail_with_logs(self, deployment_id, max_bytes=LOG_MAX_BYTES, concurrency=8):
+        """Fails the test, after saving the deployment logs of all the devices
+        into mender_test_logs; only a summary goes into the failure message."""
+
+        def save(device):
+            filename = os.path.join(
+                log.TEST_LOGS_PATH,
+                "deployment-%s-device-%s.log" % (deployment_id, device["id"]),
+            )
+            try:
+                written, truncated = self.save_logs(
+                    device["id"], deployment_id, filename, max_bytes=max_bytes
+                )
+            except Exception as e:
+                logger.warning(
+                    "failed to get logs of device %s: %s" % (device["id"], e)
+                )
+                return "%s: failed to get logs (%s)" % (device["id"], e)
+            with open(filename, "rb") as f:
+                f.seek(max(0, written - LOG_TAIL_BYTES))
+                tail = f.read().decode(errors="replace")
+            return "%s: %d bytes%s saved to %s, ending with:\n%s" % (
+                device["id"],
+                written,
+                " (truncated)" if truncated else "",
+                filename,
+                tail,
+            )
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            summaries = list(executor.map(save, self.devauth.get_devices()))
+
+        pytest.fail(
+            "deployment unexpectedly failed, here are the deployment logs: \n\n %s"
+            % ("\n\n".join(summaries))
+        )
+
     def get_deployment_overview(self, deployment_id):
         deployments_overview_url = (
             self.get_deployments_base_path()
@@ -346,3 +538,46 @@ class Deployments:
             json={"update_control_map": update_control_map},
         )
         assert r.status_code == requests.status_codes.codes.no_content
+
+
+def check_expected_statistics_many(
+    expected, require_all=True, max_wait=10 * 60, polling_frequency=0.2
+):
+    """Waits for the statistics of several deployments at once, possibly of
+    different tenants.
+
+    expected is a list of (Deployments, deployment_id, (expected_status,
+    expected_count)) tuples, each deployment being polled through its own
+    Deployments object. Returns the WaitResult as soon as all of them (or any
+    of them, if require_all is False) are met."""
+
+    def condition(deploy, deployment_id, expected_status, expected_count):
+        def met(data):
+            if int(data["failure"]) > 0 and expected_status != "failure":
+                deploy.fail_with_logs(deployment_id)
+            return data[expected_status] == expected_count
+
+        return met
+
+    result = wait_for_conditions(
+        {
+            deployment_id: (
+                functools.partial(deploy.get_statistics, deployment_id),
+                condition(deploy, deployment_id, expected_status, expected_count),
+            )
+            for deploy, deployment_id, (expected_status, expected_count) in expected
+        },
+        max_wait,
+        require_all=require_all,
+        initial=polling_frequency,
+    )
+    if not result.ok:
+        pytest.fail(
+            "Never found the expected statistics for deployments %s after %d seconds"
+            % (sorted({d for _, d, _ in expected} - set(result.value)), max_wait)
+        )
+    logger.info(
+        "got expected statistics for deployments %s after %.1fs and %d polls"
+        % (sorted(result.value), result.elapsed, result.polls)
+    )
+    return result
@@ -17,9 +17,14 @@ import json
 import requests
 import pytest
 
+from concurrent.futures import ThreadPoolExecutor
+
 from . import logger
 from . import get_container_manager
 from .requests_helpers import requests_retry
+from .waiters import wait_for_conditions, wait_until
+from testutils.api import deviceauth
+from testutils.api.client import ApiClient
 
 
 class DeviceAuthV2:
@@ -42,49 +47,83 @@ class DeviceAuthV2:
             url, verify=False, headers=self.auth.get_auth_token()
         )
 
+    def list_devices(self):
+        """Returns all the devices, following the pages of the listing."""
+        client = ApiClient(
+            deviceauth.URL_MGMT, host=get_container_manager().get_mender_gateway()
+        )
+        return list(client.paginate("/devices", headers=self.auth.get_auth_token()))
+
     def get_devices(self, expected_devices=1):
         return self.get_devices_status(expected_devices=expected_devices)
 
+    def get_devices_count(self, status=None):
+        """Returns the number of devices, with the given status if any, or
+        None if it couldn't be counted."""
+        r = requests_retry().get(
+            self.get_devauth_base_path() + "devices/count",
+            params={"status": status} if status else None,
+            verify=False,
+            headers=self.auth.get_auth_token(),
+        )
+        if r.status_code != requests.status_codes.codes.ok:
+            logger.info("failed to count devices (payload: %s)" % r.text)
+            return None
+        return r.json()["count"]
+
     # return devices with the specified status
     def get_devices_status(
-        self, status=None, expected_devices=1, max_wait=10 * 60, no_assert=False
+        self,
+        status=None,
+        expected_devices=1,
+        max_wait=10 * 60,
+        no_assert=False,
+        settle_time=5,
     ):
         device_status_path = self.get_devauth_base_path() + "devices"
-        devices = None
-        starttime = time.time()
-        sleeptime = 5
-
-        got_devices = False
-        while starttime + max_wait >= time.time():
-            time.sleep(sleeptime)
-            # Linear backoff
-            sleeptime += 5
-            logger.info("getting all devices from: %s" % (device_status_path))
-            devices = requests_retry().get(
-                device_status_path, headers=self.auth.get_auth_token(), verify=False
+
+        # Poll the device counts, which are cheap, and only list the devices
+        # once there are enough of them and, if a status is given, once the
+        # count of the devices with that status reached the expected number,
+        # or hasn't changed for settle_time seconds.
+        last_change = {}
+
+        def poll():
+            total = self.get_devices_count()
+            return total, self.get_devices_count(status) if status else total
+
+        def condition(counts):
+            total, count = counts
+            now = time.monotonic()
+            if last_change.get("count") != count:
+                last_change.update(count=count, time=now)
+            if total is None or count is None or total < expected_devices:
+                return False
+            settled = now - last_change["time"] >= settle_time
+            return count >= expected_devices or settled
+
+        result = wait_until(poll, condition, max_wait)
+        total, count = result.value
+        if result.ok:
+            logger.info(
+                "found %d devices (%d %s) after %.1fs and %d polls"
+                % (total, count, status or "in total", result.elapsed, result.polls)
+            )
+        else:
+            logger.info(
+                "only found %s devices (%s %s) after %d seconds"
+                % (total, count, status or "in total", max_wait)
             )
-            if (
-                devices.status_code == requests.status_codes.codes.ok
-                and len(devices.json()) >= expected_devices
-            ):
-                got_devices = True
-                break
-            else:
-                if devices is not None and getattr(devices, "text"):
-                    logger.info(
-                        "fail to get devices (payload: %s), will try for at least %d more seconds"
-                        % (devices.text, starttime + max_wait - time.time())
-                    )
-                else:
-                    logger.info(
-                        "failed to get devices, will try for at least %d more seconds"
-                        % (starttime + max_wait - time.time())
-                    )
 
         if not no_assert:
-            assert got_devices, "Not able to get devices"
+            assert result.ok, "Not able to get devices"
 
-        devices_json = devices.json()
+        logger.info("getting all devices from: %s" % (device_status_path))
+        try:
+            devices_json = self.list_devices()
+        except AssertionError as e:
+            assert no_assert, "fail to get devices (payload: %s)" % e
+            return []
 
         if not status:
             return devices_json
@@ -111,61 +150,71 @@ class DeviceAuthV2:
     def check_expected_status(
         self, status, expected_value, max_wait=10 * 60, polling_frequency=1
     ):
-        timeout = time.time() + max_wait
         seen = set()
 
-        while time.time() <= timeout:
-            time.sleep(polling_frequency)
-
-            data = self.get_devices_status(status)
-            seen.add(str(data))
+        def poll():
+            count = self.get_devices_count(status)
+            seen.add(count)
+            return count
 
-            count = 0
-            for device in data:
-                if device["status"] == status:
-                    count += 1
-
-            if count != expected_value:
-                continue
-            else:
-                return
-
-        if time.time() > timeout:
+        result = wait_until(
+            poll,
+            lambda count: count == expected_value,
+            max_wait,
+            maximum=polling_frequency,
+        )
+        if not result.ok:
             pytest.fail(
                 "Never found: %s:%s, only seen: %s"
                 % (status, expected_value, str(seen))
             )
 
-    def accept_devices(self, expected_devices):
-        if len(
-            self.get_devices_status("accepted", expected_devices=expected_devices)
-        ) == len(get_container_manager().get_mender_clients()):
+    def get_device_statuses(self):
+        """Returns the auth status of every device, by device ID, from one
+        listing of all the pages of devices."""
+        return {d["id"]: d["status"] for d in self.list_devices()}
+
+    def accept_devices(self, expected_devices, concurrency=8):
+        devices = self.get_devices(expected_devices=expected_devices)
+        if len([d for d in devices if d["status"] == "accepted"]) == len(
+            get_container_manager().get_mender_clients()
+        ):
             return
 
-        # iterate over devices and accept them
-        for d in self.get_devices(expected_devices=expected_devices):
+        # accept all the devices at once
+        def accept(d):
             self.set_device_auth_set_status(
                 d["id"], d["auth_sets"][0]["id"], "accepted"
             )
+            return d["id"], time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            accepted_at = dict(executor.map(accept, devices))
 
-        # block until devices are actually accepted
+        # block until devices are actually accepted, all of them being checked
+        # against the same listing of the devices
         accept_timeout = 120
-        timeout = time.time() + accept_timeout
-        while time.time() <= timeout:
-            time.sleep(1)
-            if (
-                len(
-                    self.get_devices_status(
-                        status="accepted", expected_devices=expected_devices
-                    )
-                )
-                == expected_devices
-            ):
-                break
-
-        if time.time() > timeout:
+        latencies = {}
+
+        def condition(device_id):
+            def accepted(statuses):
+                if statuses.get(device_id) != "accepted":
+                    return False
+                latencies[device_id] = time.monotonic() - accepted_at[device_id]
+                return True
+
+            return accepted
+
+        poll = self.get_device_statuses
+        result = wait_for_conditions(
+            {device_id: (poll, condition(device_id)) for device_id in accepted_at},
+            accept_timeout,
+        )
+        if not result.ok:
             pytest.fail(f"wasn't able to accept device after {accept_timeout} seconds")
 
+        for device_id, latency in sorted(latencies.items()):
+            logger.info("device [%s] accepted after %.1fs" % (device_id, latency))
         logger.info("Successfully bootstrap all clients")
 
     def preauth(self, device_identity, pubkey):
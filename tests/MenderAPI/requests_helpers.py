@@ -12,19 +12,287 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from http.cookiejar import DefaultCookiePolicy
+
 import requests
-from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from testutils.api import http2, metrics
+from testutils.api.cassette import CassetteAdapter
 
-# Will retry on server errors (5xx)
-def requests_retry(status_forcelist=[500, 502, 503, 504]):
+logger = logging.getLogger()
+
+# Maximum number of keep-alive connections kept per host by each session
+POOL_SIZE = int(os.environ.get("MENDER_API_POOL_SIZE") or 10)
+
+# Sessions are per thread, and are dropped when the generation changes
+_local = threading.local()
+_generation = 0
+
+# Hooks called with every response of the sessions, besides the metrics one
+response_hooks = []
+
+# Maximum number of responses kept by ConditionalCache
+RESPONSE_CACHE_SIZE = int(os.environ.get("MENDER_API_RESPONSE_CACHE_SIZE") or 256)
+
+
+def reset_sessions(pool_size=None):
+    """Drop the sessions of all the threads, e.g. when the backend changes,
+    optionally changing the pool size of the sessions created from then on."""
+    global _generation, POOL_SIZE
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    _generation += 1
+    _close_sessions()
+
+
+def _close_sessions():
+    for session in getattr(_local, "sessions", {}).values():
+        session.close()
+    _local.sessions = {}
+    _local.generation = _generation
+
+
+def _new_session(status_forcelist):
     s = requests.Session()
+    # The session is shared by all the users of the thread
+    s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
     retries = Retry(
         total=5,
         backoff_factor=1,
         status_forcelist=status_forcelist,
         allowed_methods=["HEAD", "GET", "POST", "PUT", "DELETE", "OPTIONS", "TRACE"],
     )
-    s.mount("https://", HTTPAdapter(max_retries=retries))
+    if http2.enabled:
+        s.mount("https://", http2.Http2Adapter(max_retries=retries))
+    else:
+        s.mount(
+            "https://",
+            CassetteAdapter(
+                max_retries=retries, pool_connections=1, pool_maxsize=POOL_SIZE
+            ),
+        )
+    s.hooks["response"].append(metrics.response_hook)
+    s.hooks["response"].extend(response_hooks)
+    return s
+
+
+# Will retry on server errors (5xx)
+def requests_retry(status_forcelist=[500, 502, 503, 504]):
+    """Returns the long-lived session of the calling thread for the given
+    retry policy, so that connections are kept alive between calls."""
+    if getattr(_local, "generation", None) != _generation:
+        _close_sessions()
+    key = tuple(status_forcelist)
+    s = _local.sessions.get(key)
+    if s is None:
+        s = _local.sessions[key] = _new_session(status_forcelist)
     return s
+
+
+class ConditionalCache:
+    """Cache of JSON GET responses, keyed by URL, query and credentials.
+
+    Cached entries are revalidated with If-None-Match/If-Modified-Since when
+    the service sent an ETag/Last-Modified header. Otherwise an unchanged
+    body is detected by its digest. The bodies are kept as received, and
+    parsed anew for every caller. Only the max_entries most recently used
+    entries are kept.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.entries = collections.OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries = collections.OrderedDict()
+
+    def get_json(self, url, headers={}, params=None, session=None):
+        """Returns (response, data, changed): the 200 response, its parsed
+        body, a copy of its own for every call, and whether it changed since
+        the last call."""
+        key = (
+            url,
+            json.dumps(params, sort_keys=True),
+            headers.get("Authorization"),
+        )
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        headers = dict(headers)
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        r = (session or requests_retry()).get(
+            url, params=params, headers=headers, verify=False
+        )
+        if entry is not None and r.status_code == 304:
+            return entry["response"], json.loads(entry["response"].content), False
+        if r.status_code != 200:
+            return r, None, True
+
+        digest = hashlib.sha256(r.content).digest()
+        if entry is not None and entry["digest"] == digest:
+            return entry["response"], r.json(), False
+
+        data = r.json()
+        entry = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "digest": digest,
+            "response": r,
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return r, data, True
+
+
+response_cache = ConditionalCache()
+
+
+# Request bodies are streamed from disk this many bytes at a time
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StreamingBody:
+    """File-like request body concatenating in-memory bytes and files, read
+    from disk chunk by chunk instead of being loaded in memory. It has a
+    length, so that it is sent with a Content-Length, and can be rewound
+    for retries. The progress and throughput of the transfer are logged."""
+
+    def __init__(self, parts, description="upload", chunk_size=STREAM_CHUNK_SIZE):
+        self.description = description
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.offsets = []
+        self.length = 0
+        for part in parts:
+            if isinstance(part, bytes):
+                fd, size = io.BytesIO(part), len(part)
+            else:
+                fd, size = open(part, "rb"), os.path.getsize(part)
+            self.parts.append(fd)
+            self.offsets.append(self.length)
+            self.length += size
+        self.position = 0
+        self.start = None
+        self.next_report = 0
+
+    def __len__(self):
+        return self.length
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = max(0, min(offset, self.length))
+        self.next_report = self.position
+        for fd, start in zip(self.parts, self.offsets):
+            fd.seek(max(0, self.position - start))
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        if self.start is None:
+            self.start = time.monotonic()
+        data = b""
+        # Parts before the current position are at their end
+        for fd in self.parts:
+            if len(data) >= size:
+                break
+            data += fd.read(size - len(data))
+        self.position += len(data)
+        self._report_progress()
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _report_progress(self):
+        if self.position < self.next_report or self.next_report > self.length:
+            return
+        if self.position < self.length:
+            self.next_report = self.position + max(self.length // 10, 1)
+        else:
+            self.next_report = self.length + 1
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        logger.info(
+            "%s: %d/%d bytes (%d%%), %.1f MB/s"
+            % (
+                self.description,
+                self.position,
+                self.length,
+                100 * self.position // self.length,
+                self.position / elapsed / 1e6,
+            )
+        )
+
+    def close(self):
+        for fd in self.parts:
+            fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultipartFileBody(StreamingBody):
+    """multipart/form-data StreamingBody made of the given (name, value)
+    fields followed by the file itself."""
+
+    def __init__(
+        self,
+        fields,
+        file_field,
+        filename,
+        content_type="application/octet-stream",
+        **kwargs,
+    ):
+        self.boundary = uuid.uuid4().hex
+        preamble = "".join(
+            '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+            % (self.boundary, name, value)
+            for name, value in fields
+        )
+        preamble += (
+            '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            "Content-Type: %s\r\n\r\n"
+            % (self.boundary, file_field, os.path.basename(filename), content_type)
+        )
+        epilogue = "\r\n--%s--\r\n" % self.boundary
+        super().__init__([preamble.encode(), filename, epilogue.encode()], **kwargs)
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary=%s" % self.boundary
@@ -0,0 +1,86 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import random
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Outcome of a wait: whether it succeeded, how long it took, how many polls
+# it made, and the value returned by the last poll.
+WaitResult = namedtuple("WaitResult", ["ok", "elapsed", "polls", "value"])
+
+
+def backoff(initial=0.2, factor=1.5, maximum=5.0, jitter=0.2):
+    """Yields ever increasing sleep times, up to `maximum`, each of them
+    randomized by +/- `jitter` (relative)."""
+    delay = initial
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * factor, maximum)
+
+
+def wait_until(poll, condition, max_wait, initial=0.2, maximum=5.0):
+    """Calls poll() until condition(value) holds for the value it returns,
+    or until max_wait seconds have passed, backing off between polls."""
+    start = time.monotonic()
+    deadline = start + max_wait
+    polls = 0
+    for delay in backoff(initial=initial, maximum=maximum):
+        value = poll()
+        polls += 1
+        if condition(value):
+            return WaitResult(True, time.monotonic() - start, polls, value)
+        now = time.monotonic()
+        if now >= deadline:
+            return WaitResult(False, now - start, polls, value)
+        time.sleep(min(delay, deadline - now))
+
+
+def wait_for_conditions(
+    conditions, max_wait, require_all=True, initial=0.2, maximum=5.0, concurrency=8
+):
+    """Waits on several conditions at once, given as {key: (poll, condition)}.
+
+    Each round calls concurrently the polls of the conditions not met yet,
+    calling each distinct poll function once, so that conditions sharing a
+    poll (e.g. one listing of all the devices) are checked in one request.
+    Returns as soon as all of the conditions are met, or any of them if
+    require_all is False. The value of the WaitResult maps the keys of the
+    conditions met to the value they were met with.
+    """
+    start = time.monotonic()
+    deadline = start + max_wait
+    met = {}
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for delay in backoff(initial=initial, maximum=maximum):
+            pending = {k: c for k, c in conditions.items() if k not in met}
+            # Keyed on the polls themselves rather than on their id(): every
+            # access to obj.method makes a new bound method, equal to the
+            # others but with its own id
+            polls = list(dict.fromkeys(poll for poll, _ in pending.values()))
+            values = dict(zip(polls, executor.map(lambda p: p(), polls)))
+            rounds += 1
+            for key, (poll, condition) in pending.items():
+                if condition(values[poll]):
+                    met[key] = values[poll]
+
+            if len(met) == len(conditions) or (met and not require_all):
+                return WaitResult(True, time.monotonic() - start, rounds, met)
+            now = time.monotonic()
+            if now >= deadline:
+                return WaitResult(False, now - start, rounds, met)
+            time.sleep(min(delay, deadline - now))
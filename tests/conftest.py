@@ -17,7 +17,6 @@ import os
 import re
 import subprocess
 import shutil
-import tempfile
 import packaging.version
 
 import multiprocessing
@@ -25,8 +24,13 @@ import multiprocessing
 import filelock
 import pytest
 from filelock import FileLock
+from testutils.api import cassette, metrics
+from testutils.api.client import connection_stats
 from testutils.infra.container_manager.base import BaseContainerManagerNamespace
 from testutils.infra.device import MenderDevice, MenderDeviceGroup
+from testutils.util.debugfs import DebugfsSession
+from testutils.util.images import image_variant
+from testutils.util.payloads import make_sparse_file, write_random_file
 
 from . import log
 from .tests.mendertesting import MenderTesting
@@ -49,6 +53,27 @@ machine_name = None
 def pytest_addoption(parser):
     parser.addoption("--runslow", action="store_true", help="run slow tests")
     parser.addoption("--runfast", action="store_true", help="run fast tests")
+    parser.addoption(
+        "--runbenchmarks", action="store_true", help="run performance benchmarks"
+    )
+    parser.addoption(
+        "--api-metrics",
+        action="store_true",
+        help="record per endpoint API latencies into mender_test_logs",
+    )
+    parser.addoption(
+        "--api-cassettes",
+        action="store",
+        default=None,
+        help="directory of the per test API cassettes, see --api-cassette-mode",
+    )
+    parser.addoption(
+        "--api-cassette-mode",
+        action="store",
+        choices=[cassette.RECORD, cassette.REPLAY],
+        default=cassette.RECORD,
+        help="record the API calls into the cassettes, or replay them from there",
+    )
 
     parser.addoption(
         "--machine-name",
@@ -124,67 +149,30 @@ def valid_image():
     return image(compose_file, filename)
 
 
-def _special_image(image, command):
-    subprocess.run(command, check=True)
-    return image
-
-
 @pytest.fixture(scope="session")
 def broken_network_image(valid_image):
-    image = f"core-image-full-cmdline-{machine_name}-broken-network.ext4"
-    shutil.copy(valid_image, image)
-    return _special_image(
-        image,
-        ["debugfs", "-w", "-R", "rm /lib/systemd/systemd-networkd", image],
-    )
+    return image_variant(valid_image, remove=["/lib/systemd/systemd-networkd"])
 
 
 @pytest.fixture(scope="session")
 def large_image():
-    return _special_image(
-        "large_image.dat",
-        ["dd", "if=/dev/zero", "of=large_image.dat", "bs=500M", "count=1"],
-    )
+    return make_sparse_file("large_image.dat", 500 * 1024 * 1024)
 
 
 @pytest.fixture(scope="session")
 def broken_update_image():
-    return _special_image(
-        "broken_update.ext4",
-        ["dd", "if=/dev/urandom", "of=broken_update.ext4", "bs=10M", "count=5"],
-    )
-
-
-def add_mender_conf_to_image(image, d, mender_conf):
-    """Copy image to the dir 'd', and replace the images /etc/mender/mender.conf
-    with the contents of the string 'mender_conf'"""
-
-    mender_conf_tmp = os.path.join(d, "mender.conf")
+    return write_random_file("broken_update.ext4", 50 * 1024 * 1024)
 
-    with open(mender_conf_tmp, "w") as f:
-        f.write(mender_conf)
 
-    new_image = os.path.join(d, image)
-    shutil.copy(image, new_image)
+def add_mender_conf_to_image(image, mender_conf):
+    """Return a copy of image, whose /etc/mender/mender.conf is replaced with
+    the contents of the string 'mender_conf'"""
 
-    instr_file = os.path.join(d, "write.instr")
-    with open(os.path.join(d, "write.instr"), "w") as f:
-        f.write("""cd /etc/mender
-        rm mender.conf
-        write {local} mender.conf""".format(local=mender_conf_tmp))
-    subprocess.run(
-        ["debugfs", "-w", "-f", instr_file, new_image],
-        check=True,
-        stdout=subprocess.PIPE,
-    )
-
-    res = subprocess.run(
-        ["debugfs", "-R", "cat /etc/mender/mender.conf", new_image],
-        check=True,
-        stdout=subprocess.PIPE,
-    )
+    new_image = image_variant(image, files={"/etc/mender/mender.conf": mender_conf})
 
-    assert "ServerURL" in res.stdout.decode()
+    fs = DebugfsSession(new_image)
+    fs.read("/etc/mender/mender.conf")
+    assert "ServerURL" in fs.run()["/etc/mender/mender.conf"].decode()
 
     return new_image
 
@@ -192,8 +180,7 @@ def add_mender_conf_to_image(image, d, mender_conf):
 @pytest.fixture(scope="session")
 def valid_image_with_mender_conf(valid_image):
     """Insert the given mender_conf into a valid_image"""
-    with tempfile.TemporaryDirectory() as d:
-        yield lambda conf: add_mender_conf_to_image(valid_image, d, conf)
+    yield lambda conf: add_mender_conf_to_image(valid_image, conf)
 
 
 @pytest.fixture(scope="session")
@@ -208,8 +195,7 @@ def valid_image_rofs_with_mender_conf():
         yield None
         return
 
-    with tempfile.TemporaryDirectory() as d:
-        yield lambda conf: add_mender_conf_to_image(valid_image, d, conf)
+    yield lambda conf: add_mender_conf_to_image(valid_image, conf)
 
 
 @pytest.fixture(scope="session")
@@ -224,8 +210,7 @@ def valid_image_rofs_commercial_with_mender_conf():
         yield None
         return
 
-    with tempfile.TemporaryDirectory() as d:
-        yield lambda conf: add_mender_conf_to_image(valid_image, d, conf)
+    yield lambda conf: add_mender_conf_to_image(valid_image, conf)
 
 
 def pytest_configure(config):
@@ -242,6 +227,9 @@ def pytest_configure(config):
 
     MenderTesting.set_test_conditions(config)
 
+    if config.getoption("--api-metrics"):
+        metrics.enable()
+
     config.addinivalue_line(
         "markers",
         "min_mender_client_version: indicate lowest Mender client version for which the test will run",
@@ -275,6 +263,34 @@ except ImportError:
         logger.info("%s is starting.... " % test_name)
 
 
+@pytest.fixture(scope="function", autouse=True)
+def api_metrics(request):
+    metrics.test_metrics.reset()
+    yield
+    if metrics.enabled:
+        metrics.test_metrics.dump(
+            os.path.join(
+                log.TEST_LOGS_PATH,
+                log.slugify(unique_test_name(request)) + ".api-metrics.json",
+            )
+        )
+
+
+@pytest.fixture(scope="function", autouse=True)
+def api_cassette(request):
+    cassettes_dir = request.config.getoption("--api-cassettes")
+    if cassettes_dir is None:
+        yield None
+        return
+    path = os.path.join(
+        cassettes_dir, log.slugify(unique_test_name(request)) + ".jsonl.gz"
+    )
+    with cassette.use_cassette(
+        path, request.config.getoption("--api-cassette-mode")
+    ) as api_cassette:
+        yield api_cassette
+
+
 def pytest_exception_interact(node, call, report):
     if report.failed:
         logger.error(
@@ -410,6 +426,25 @@ def pytest_exception_interact(node, call, report):
             logger.info(line)
 
 
+def pytest_sessionfinish(session, exitstatus):
+    if metrics.enabled:
+        worker_id = os.environ.get("PYTEST_XDIST_WORKER", "master")
+        metrics.session_metrics.dump(
+            os.path.join(log.TEST_LOGS_PATH, "api-metrics-%s.json" % worker_id)
+        )
+
+    stats = connection_stats()
+    logger.info(
+        "ApiClient connections: %d requests, %d handshakes (%.2fs), %d reused"
+        % (
+            stats["requests"],
+            stats["handshakes"],
+            stats["handshake_time"],
+            stats["reused"],
+        )
+    )
+
+
 def verify_sane_test_environment():
     # check if required tools are in PATH, add any other checks here
     if shutil.which("mender-artifact") is None:
@@ -12,8 +12,4 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-import filelock
-
 from .mendertesting import MenderTesting
-
-artifact_lock = filelock.FileLock(".artifact_modification_lock")
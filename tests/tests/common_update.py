@@ -12,14 +12,26 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import contextlib
+import os
 import tempfile
 import random
 
+import filelock
 import pytest
 
 from .. import conftest
 from ..MenderAPI import devauth, deploy, image, logger
-from . import artifact_lock
+
+# Serialize the artifact builds, uploads and deployments of all the xdist
+# workers behind one lock, as they used to be. Only meant for benchmarking.
+GLOBAL_ARTIFACT_LOCK = bool(os.getenv("MENDER_GLOBAL_ARTIFACT_LOCK"))
+
+
+def _artifact_lock():
+    if GLOBAL_ARTIFACT_LOCK:
+        return filelock.FileLock(".artifact_modification_lock")
+    return contextlib.nullcontext()
 
 
 def common_update_procedure(
@@ -38,9 +50,14 @@ def common_update_procedure(
     devauth=devauth,
     deploy=deploy,
     autogenerate_delta=False,
+    direct_upload=False,
 ):
 
-    with artifact_lock:
+    # No lock is needed here: each artifact is built into its own temporary
+    # file, and the upload and the deployment only touch this test's backend.
+    # The global lock they used to be serialized with can be brought back,
+    # to compare against it, see GLOBAL_ARTIFACT_LOCK.
+    with _artifact_lock():
         artifact_name = "mender-%s" % str(random.randint(0, 99999999))
         logger.debug("randomized image id: " + artifact_name)
 
@@ -63,7 +80,10 @@ def common_update_procedure(
 
             if created_artifact:
                 pre_upload_callback()
-                deploy.upload_image(created_artifact)
+                if direct_upload:
+                    deploy.direct_upload_image(created_artifact)
+                else:
+                    deploy.upload_image(created_artifact)
                 if devices is None:
                     devices = list(
                         set(
@@ -109,6 +129,7 @@ def update_image(
     devauth=devauth,
     deploy=deploy,
     autogenerate_delta=False,
+    direct_upload=False,
 ):
     """
     Perform a successful upgrade, and assert that deployment status/logs are correct.
@@ -134,6 +155,7 @@ def update_image(
             devauth=devauth,
             deploy=deploy,
             autogenerate_delta=autogenerate_delta,
+            direct_upload=direct_upload,
         )
         reboot.verify_reboot_performed()
 
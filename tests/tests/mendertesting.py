@@ -18,9 +18,11 @@ import pytest
 class MenderTesting(object):
     slow_cond = False
     fast_cond = False
+    benchmark_cond = False
 
     slow = None
     fast = None
+    benchmark = None
 
     @staticmethod
     def set_test_conditions(config):
@@ -45,3 +47,10 @@ class MenderTesting(object):
         MenderTesting.fast = pytest.mark.skipif(
             not MenderTesting.fast_cond, reason="need --runfast option to run"
         )
+
+        # Benchmarks are never run by default
+        MenderTesting.benchmark_cond = bool(config.getoption("--runbenchmarks"))
+        MenderTesting.benchmark = pytest.mark.skipif(
+            not MenderTesting.benchmark_cond,
+            reason="need --runbenchmarks option to run",
+        )
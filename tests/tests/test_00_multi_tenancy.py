@@ -15,10 +15,14 @@
 import uuid
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 from ..common_setup import enterprise_no_client
 from ..helpers import Helpers
 from ..MenderAPI import auth, devauth, logger, inv
-from .common_update import update_image
+from ..MenderAPI import Authentication, Deployments, DeviceAuthV2
+from ..MenderAPI import check_expected_statistics_many
+from .common_update import common_update_procedure
 from .mendertesting import MenderTesting
 from testutils.common import new_tenant_client
 
@@ -84,6 +88,7 @@ class TestMultiTenancyEnterprise(MenderTesting):
             },
         ]
 
+        tenants = []
         for user in users:
             auth.new_tenant(user["username"], user["email"], user["password"])
             t = auth.current_tenant["tenant_token"]
@@ -104,9 +109,39 @@ class TestMultiTenancyEnterprise(MenderTesting):
             )
             update_image_name = valid_image_with_mender_conf(mender_conf)
 
-            host_ip = enterprise_no_client.get_virtual_network_host_ip()
-            update_image(
-                mender_device,
-                host_ip,
-                install_image=update_image_name,
+            # The global auth moves on to the next tenant, the update of this
+            # one goes through its own API objects
+            tenant_auth = Authentication(
+                name=user["username"], username=user["email"], password=user["password"]
             )
+            tenant_auth.org_create = False
+            tenants.append((mender_device, update_image_name, tenant_auth))
+
+        # Update the devices of both tenants at once, and wait for both of
+        # the deployments together, instead of for each update in turn.
+        host_ip = enterprise_no_client.get_virtual_network_host_ip()
+
+        def update(tenant):
+            mender_device, update_image_name, tenant_auth = tenant
+            tenant_devauth = DeviceAuthV2(tenant_auth)
+            tenant_deploy = Deployments(tenant_auth, tenant_devauth)
+            previous_inactive_part = mender_device.get_passive_partition()
+            with mender_device.get_reboot_detector(host_ip) as reboot:
+                deployment_id, expected_image_id = common_update_procedure(
+                    update_image_name, devauth=tenant_devauth, deploy=tenant_deploy
+                )
+                reboot.verify_reboot_performed()
+            assert mender_device.get_active_partition() == previous_inactive_part
+            return tenant_deploy, deployment_id, expected_image_id
+
+        with ThreadPoolExecutor(max_workers=len(tenants)) as executor:
+            updates = list(executor.map(update, tenants))
+
+        check_expected_statistics_many(
+            [(d, deployment_id, ("success", 1)) for d, deployment_id, _ in updates]
+        )
+        for (mender_device, _, _), (tenant_deploy, deployment_id, image_id) in zip(
+            tenants, updates
+        ):
+            assert mender_device.yocto_id_installed_on_machine() == image_id
+            tenant_deploy.check_expected_status("finished", deployment_id)
@@ -0,0 +1,109 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import json
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from .mendertesting import MenderTesting
+from testutils.api import cassette
+from testutils.api.client import ApiClient
+
+ITEMS = [{"id": i} for i in range(5)]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Stand-in for a backend service: a paginated list of items, and things
+    which are created "pending" and are "done" on the second look."""
+
+    things = {}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data, headers={}):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/items":
+            query = dict(parse_qsl(url.query))
+            page, per_page = int(query["page"]), int(query["per_page"])
+            headers = {}
+            if page * per_page < len(ITEMS):
+                headers["Link"] = '</api/items?page=%d&per_page=%d>; rel="next"' % (
+                    page + 1,
+                    per_page,
+                )
+            items = ITEMS[(page - 1) * per_page : page * per_page]
+            self.reply(200, items, headers)
+        else:
+            thing = self.things[url.path.rsplit("/", 1)[1]]
+            self.reply(200, thing)
+            thing["status"] = "done"
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        thing = {"id": str(uuid.uuid4()), "name": data["name"], "status": "pending"}
+        self.reply(201, dict(thing))
+        self.things[thing["id"]] = thing
+
+
+class TestApiCassette(MenderTesting):
+    def exercise(self, client):
+        """Lists the items, creates a thing with a random name and polls it"""
+        items = list(client.paginate("/items", per_page=2))
+        r = client.call("POST", "/things", body={"name": "thing-%s" % uuid.uuid4()})
+        assert r.status_code == 201
+        thing_id = r.json()["id"]
+        statuses = [
+            client.call("GET", "/things/{id}", path_params={"id": thing_id}).json()[
+                "status"
+            ]
+            for _ in range(3)
+        ]
+        return items, thing_id, statuses
+
+    @MenderTesting.fast
+    def test_replay_without_backend(self, tmp_path):
+        """Calls recorded against a server are replayed once it is gone, even
+        though the bodies sent carry other random names"""
+        path = str(tmp_path / "cassette.jsonl.gz")
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        host = "127.0.0.1:%d" % server.server_address[1]
+        try:
+            with cassette.use_cassette(path, cassette.RECORD):
+                recorded = self.exercise(ApiClient("/api", host=host, schema="http://"))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert recorded[0] == ITEMS
+        assert recorded[2] == ["pending", "done", "done"]
+
+        with cassette.use_cassette(path, cassette.REPLAY):
+            replayed = self.exercise(ApiClient("/api", host=host, schema="http://"))
+        assert replayed == recorded
@@ -88,8 +88,11 @@ class BaseTestCorruptDeploymentLog(MenderTesting):
             )[0]
 
             deploy.check_expected_statistics(deployment_id, "failure", 1)
-            logs = deploy.get_logs(device_id, deployment_id)
-            assert "(THE ORIGINAL LOGS CONTAINED INVALID ENTRIES)" in logs
+            assert deploy.find_in_logs(
+                device_id,
+                deployment_id,
+                "(THE ORIGINAL LOGS CONTAINED INVALID ENTRIES)",
+            )
         except:
             output = mender_device.run(
                 "cat /data/mender/deployment*.log", warn_only=True
@@ -161,8 +164,14 @@ class BaseTestCorruptDeploymentLog(MenderTesting):
             )[0]
 
             deploy.check_expected_statistics(deployment_id, "failure", 1)
-            logs = deploy.get_logs(device_id, deployment_id, n_tries=5)
-            assert "(THE ORIGINAL LOGS WERE TOO BIG" in logs
+            # Stream the log rather than loading it as a whole, stopping at the
+            # trimming notice.
+            assert deploy.find_in_logs(
+                device_id,
+                deployment_id,
+                "(THE ORIGINAL LOGS WERE TOO BIG",
+                n_tries=5,
+            )
         except:
             output = mender_device.run(
                 "cat /data/mender/deployment*.log | grep -v 'some useless log message here'",
@@ -157,6 +157,24 @@ class BaseTestBasicIntegration(MenderTesting):
             deploy=deploy,
         )
 
+    def do_test_update_direct_upload(self, env, valid_image_with_mender_conf):
+        """Uploads the artifact straight to the storage, and runs the whole
+        update process."""
+        devauth = DeviceAuthV2(env.auth)
+        deploy = Deployments(env.auth, devauth)
+
+        mender_device = env.device
+        mender_conf = mender_device.run("cat /etc/mender/mender.conf")
+
+        update_image(
+            env.device,
+            env.get_virtual_network_host_ip(),
+            install_image=valid_image_with_mender_conf(mender_conf),
+            devauth=devauth,
+            deploy=deploy,
+            direct_upload=True,
+        )
+
     def do_test_forced_update_check_from_client(
         self, env, valid_image_with_mender_conf
     ):
@@ -376,6 +394,16 @@ class TestBasicIntegrationOpenSource(BaseTestBasicIntegration):
             valid_image_with_mender_conf,
         )
 
+    def test_update_direct_upload(
+        self,
+        standard_setup_one_client_bootstrapped,
+        valid_image_with_mender_conf,
+    ):
+        self.do_test_update_direct_upload(
+            standard_setup_one_client_bootstrapped,
+            valid_image_with_mender_conf,
+        )
+
     def test_forced_update_check_from_client(
         self, standard_setup_one_client_bootstrapped, valid_image_with_mender_conf
     ):
@@ -445,6 +473,16 @@ class TestBasicIntegrationEnterprise(BaseTestBasicIntegration):
             valid_image_with_mender_conf,
         )
 
+    def test_update_direct_upload(
+        self,
+        enterprise_one_client_bootstrapped,
+        valid_image_with_mender_conf,
+    ):
+        self.do_test_update_direct_upload(
+            enterprise_one_client_bootstrapped,
+            valid_image_with_mender_conf,
+        )
+
     def test_forced_update_check_from_client(
         self, enterprise_one_client_bootstrapped, valid_image_with_mender_conf
     ):
@@ -0,0 +1,173 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import os
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from ..common_setup import standard_setup_one_client, standard_setup_without_client
+from ..MenderAPI import auth, devauth, logger
+from .mendertesting import MenderTesting
+from testutils.api import http2
+from testutils.api.client import ApiClient, new_session
+from testutils.common import create_user, make_pending_devices
+from testutils.util import crypto
+import testutils.api.deviceauth as deviceauth
+import testutils.api.useradm as useradm
+
+
+def measure_throughput(get, url, headers, n_requests=1000, concurrency=16):
+    """Returns the number of requests per second sent with get()"""
+
+    def request(_):
+        r = get(url, headers=headers, verify=False)
+        assert r.status_code == 200, r.text
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(request, range(n_requests)))
+    return n_requests / (time.monotonic() - start)
+
+
+class TestApiTransportBenchmark(MenderTesting):
+    @MenderTesting.benchmark
+    def test_gateway_throughput(self, standard_setup_without_client):
+        """Compare the gateway throughput with HTTP/1.1 unpooled, HTTP/1.1
+        pooled and HTTP/2 multiplexed requests"""
+        env = standard_setup_without_client
+        url = "https://%s/api/management/v1/deployments/deployments" % (
+            env.get_mender_gateway()
+        )
+        headers = auth.get_auth_token()
+
+        transports = {
+            "HTTP/1.1 unpooled": requests.get,
+            "HTTP/1.1 pooled": new_session(pool_size=16, use_http2=False).get,
+        }
+        if http2.httpx is not None:
+            transports["HTTP/2"] = new_session(use_http2=True).get
+        else:
+            logger.warning("httpx is not installed, skipping HTTP/2")
+
+        for name, get in transports.items():
+            rate = measure_throughput(get, url, headers)
+            logger.info("%s: %.1f requests/s" % (name, rate))
+
+
+class TestBootstrapBenchmark(MenderTesting):
+    @MenderTesting.benchmark
+    def test_bootstrap_to_accepted_latency(self, standard_setup_one_client):
+        """Measure what the *_bootstrapped fixtures spend waiting for the
+        device to show up and to be accepted"""
+        start = time.monotonic()
+        devauth.get_devices_status("pending", expected_devices=1)
+        pending = time.monotonic() - start
+        devauth.accept_devices(1)
+        accepted = time.monotonic() - start
+        logger.info(
+            "device pending after %.1fs, accepted after %.1fs" % (pending, accepted)
+        )
+
+
+# Tests run by the suite wall time benchmark, which build and deploy artifacts
+BENCHMARK_SUITE = os.getenv(
+    "MENDER_BENCHMARK_SUITE",
+    "tests/test_image_update_failures.py tests/test_signed_image_update.py",
+).split()
+
+
+class TestSuiteWallTimeBenchmark(MenderTesting):
+    @MenderTesting.benchmark
+    @pytest.mark.parametrize("global_lock", [False, True])
+    @pytest.mark.parametrize("workers", [4, 8])
+    def test_suite_wall_time(self, request, tmp_path, workers, global_lock):
+        """Measure the wall time of a fixed subset of the suite run by 4 and 8
+        xdist workers, with and without the global artifact lock. Every run
+        starts cold, without the artifacts and image variants cached by the
+        previous ones."""
+        pytest.importorskip("xdist")
+        env = dict(os.environ)
+        env.pop("MENDER_GLOBAL_ARTIFACT_LOCK", None)
+        env["MENDER_ARTIFACT_CACHE_SIZE"] = "0"
+        env["MENDER_IMAGE_VARIANTS"] = str(tmp_path / "image_variants")
+        if global_lock:
+            env["MENDER_GLOBAL_ARTIFACT_LOCK"] = "1"
+
+        start = time.monotonic()
+        r = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pytest",
+                "-n",
+                str(workers),
+                "-p",
+                "no:cacheprovider",
+                "--machine-name",
+                request.config.getoption("--machine-name"),
+            ]
+            + BENCHMARK_SUITE,
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+            env=env,
+        )
+        elapsed = time.monotonic() - start
+        assert r.returncode == 0, "the benchmarked tests failed"
+        logger.info(
+            "%d workers, %s the global artifact lock: %.1fs"
+            % (workers, "with" if global_lock else "without", elapsed)
+        )
+
+
+class TestDeviceProvisioningBenchmark(MenderTesting):
+    @MenderTesting.benchmark
+    def test_device_provisioning_rate(self, standard_setup_without_client, monkeypatch):
+        """Compare the rate at which pending devices are provisioned with
+        keys generated on the spot and taken from a warm keypair pool"""
+        env = standard_setup_without_client
+        uadmm = ApiClient(useradm.URL_MGMT, host=env.get_mender_gateway())
+        dauthd = ApiClient(deviceauth.URL_DEVICES, host=env.get_mender_gateway())
+        dauthm = ApiClient(deviceauth.URL_MGMT, host=env.get_mender_gateway())
+
+        user = create_user(
+            "bench@tenant.com", "correcthorse", containers_namespace=env.name
+        )
+        r = uadmm.call("POST", useradm.URL_LOGIN, auth=(user.name, user.pwd))
+        assert r.status_code == 200
+        utoken = r.text
+
+        n_devices = 100
+        kind = ("rsa", 65537, 1024)
+        pools = {
+            "without pool": crypto.KeypairPool(size=0, cache_path=None),
+            "with pool": crypto.KeypairPool(size=n_devices, cache_path=None),
+        }
+        for name, pool in pools.items():
+            if pool.size > 0:
+                queue = pool.start(kind)
+                deadline = time.monotonic() + 60
+                while queue.qsize() < pool.size and time.monotonic() < deadline:
+                    time.sleep(0.1)
+            monkeypatch.setattr(crypto, "keypair_pool", pool)
+
+            start = time.monotonic()
+            make_pending_devices(dauthd, dauthm, utoken, n_devices)
+            rate = n_devices / (time.monotonic() - start)
+            logger.info("%s: %.1f devices provisioned/s" % (name, rate))
+            pool.close()
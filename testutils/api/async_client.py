@@ -0,0 +1,153 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""asyncio flavour of ApiClient, for sending thousands of calls at once from
+one worker. It requires httpx (pip install httpx)."""
+
+import asyncio
+import itertools
+import math
+import os
+import time
+
+from testutils.api import metrics
+from testutils.api.client import GATEWAY_HOSTNAME
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Maximum number of connections kept open per AsyncApiClient
+CONCURRENCY = int(os.environ.get("ASYNC_API_CLIENT_CONCURRENCY") or 64)
+
+# The connection pools of httpx spend a time quadratic in their size on every
+# request (2000 calls take 20s over one pool of 64 connections, 4s over 16
+# pools of 4), so the connections are spread over pools of this size
+POOL_SIZE = 4
+
+
+class AsyncApiClient:
+    """Same call() contract as ApiClient, over httpx.AsyncClients keeping
+    up to `concurrency` connections open in total; further calls wait for
+    one of them. It is bound to the event loop it is first used in, and
+    meant to be used as an async context manager within it."""
+
+    def __init__(
+        self,
+        base_url="",
+        host=GATEWAY_HOSTNAME,
+        schema="https://",
+        concurrency=CONCURRENCY,
+    ):
+        if httpx is None:
+            raise RuntimeError('AsyncApiClient requires "httpx"')
+        self.host = host
+        self.schema = schema
+        self.base_url = schema + host + base_url
+        self.headers = {}
+        self.concurrency = concurrency
+        limits = httpx.Limits(
+            max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE
+        )
+        self.clients = [
+            httpx.AsyncClient(verify=False, timeout=None, limits=limits)
+            for _ in range(max(1, math.ceil(concurrency / POOL_SIZE)))
+        ]
+        self._clients = itertools.cycle(self.clients)
+
+    @classmethod
+    def like(cls, client, concurrency=CONCURRENCY):
+        """Returns an AsyncApiClient sending its calls where the ApiClient
+        client does, with the same headers."""
+        base_url = client.base_url[len(client.schema + client.host) :]
+        async_client = cls(
+            base_url, host=client.host, schema=client.schema, concurrency=concurrency
+        )
+        async_client.headers.update(client.headers)
+        return async_client
+
+    def with_auth(self, token):
+        return self.with_header("Authorization", "Bearer " + token)
+
+    def with_header(self, hdr, val):
+        self.headers[hdr] = val
+        return self
+
+    async def call(
+        self,
+        method,
+        url,
+        body=None,
+        data=None,
+        path_params={},
+        qs_params={},
+        headers={},
+        auth=None,
+        files=None,
+    ):
+        url = os.path.join(self.base_url, url if not url.startswith("/") else url[1:])
+        url = url.format(**path_params)
+        kwargs = {}
+        if isinstance(data, (bytes, str)):
+            kwargs["content"] = data
+        elif data is not None:
+            kwargs["data"] = data
+        start = time.monotonic()
+        r = None
+        try:
+            r = await next(self._clients).request(
+                method,
+                url,
+                json=body,
+                params=qs_params,
+                headers=dict(self.headers, **headers),
+                auth=auth,
+                files=files,
+                **kwargs,
+            )
+            return r
+        finally:
+            metrics.record(
+                method,
+                metrics.template_path(url),
+                time.monotonic() - start,
+                status_code=r.status_code if r is not None else None,
+            )
+
+    async def post(self, url, *pargs, **kwargs):
+        return await self.call("POST", url, *pargs, **kwargs)
+
+    async def close(self):
+        for client in self.clients:
+            await client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+async def gather_calls(calls, concurrency=CONCURRENCY, return_exceptions=False):
+    """Awaits the given coroutines with at most `concurrency` of them
+    running at any time and returns their results in order."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(call):
+        async with semaphore:
+            return await call
+
+    return await asyncio.gather(
+        *[bounded(call) for call in calls], return_exceptions=return_exceptions
+    )
@@ -0,0 +1,221 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Record and replay of the API calls made through requests sessions.
+
+In "record" mode the requests are sent to the backend, and every
+request/response pair is stored. In "replay" mode no request leaves the
+process: responses are served from the cassette, matched by method, path
+and query. Among the responses recorded for a request, the first one not
+replayed yet with the same body is served, or else the first one not
+replayed yet, since the bodies carry random names and IDs which differ from
+one run to the next. Repeated requests (e.g. polling) get the recorded
+responses in order, the last one being repeated.
+
+Streamed responses (stream=True) are recorded as their body is consumed,
+so that recording doesn't buffer them. Only the part of the body which was
+read is recorded.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlparse
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RECORD = "record"
+REPLAY = "replay"
+
+# The cassette in use, if any
+active = None
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def _body_hash(body):
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode()
+    if not isinstance(body, bytes):
+        # Streamed body, can not be matched on
+        return ""
+    return hashlib.sha256(body).hexdigest()
+
+
+def match_key(request):
+    url = urlparse(request.url)
+    query = "&".join("%s=%s" % kv for kv in sorted(parse_qsl(url.query)))
+    # The concrete path: the IDs in the paths of a replay come from the
+    # recorded responses, and are the same as when recording
+    return "%s %s?%s" % (request.method, url.path, query)
+
+
+class Cassette:
+    def __init__(self, path, mode):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("unknown cassette mode: %s" % mode)
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.replayed = {}
+        self.lock = threading.Lock()
+        if mode == REPLAY:
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.setdefault(entry["key"], []).append(entry)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with gzip.open(self.path, "wt") as f:
+            for entries in self.entries.values():
+                for entry in entries:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def record(self, request, response, stream=False):
+        entry = {
+            "key": match_key(request),
+            "body": _body_hash(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "content": "",
+        }
+
+        def set_content(content):
+            entry["content"] = base64.b64encode(content).decode()
+
+        if stream:
+            response.raw = _TeeRaw(response.raw, set_content)
+        else:
+            set_content(response.content)
+        with self.lock:
+            self.entries.setdefault(entry["key"], []).append(entry)
+
+    def replay(self, request):
+        key = match_key(request)
+        body = _body_hash(request.body)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise CassetteMiss("no recorded response for: %s" % key)
+            replayed = self.replayed.setdefault(key, set())
+            left = [i for i in range(len(entries)) if i not in replayed]
+            same_body = [i for i in left if entries[i]["body"] == body]
+            if same_body or left:
+                index = (same_body or left)[0]
+                replayed.add(index)
+            else:
+                index = len(entries) - 1
+            entry = entries[index]
+
+        response = Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(entry["content"])
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class _TeeRaw:
+    """Wraps the raw urllib3 response of a streamed response, to hand the
+    body read through it to on_done once it is read, or closed."""
+
+    def __init__(self, raw, on_done):
+        self._raw = raw
+        self._on_done = on_done
+        self._chunks = []
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._on_done(b"".join(self._chunks))
+
+    def stream(self, *args, **kwargs):
+        for chunk in self._raw.stream(*args, **kwargs):
+            self._chunks.append(chunk)
+            yield chunk
+        self._finish()
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if data:
+            self._chunks.append(data)
+        else:
+            self._finish()
+        return data
+
+    def close(self):
+        self._finish()
+        self._raw.close()
+
+    def release_conn(self):
+        self._finish()
+        self._raw.release_conn()
+
+
+class CassetteAdapterMixin:
+    """Routes the requests of an HTTPAdapter through the active cassette"""
+
+    def send(self, request, *args, **kwargs):
+        cassette = active
+        if cassette is None:
+            return super().send(request, *args, **kwargs)
+        if cassette.mode == REPLAY:
+            response = cassette.replay(request)
+            response.connection = self
+            return response
+        response = super().send(request, *args, **kwargs)
+        cassette.record(request, response, stream=kwargs.get("stream", False))
+        return response
+
+
+class CassetteAdapter(CassetteAdapterMixin, HTTPAdapter):
+    pass
+
+
+@contextmanager
+def use_cassette(path, mode):
+    """Records into, or replays from, the cassette file at path"""
+    global active
+    cassette = Cassette(path, mode)
+    active = cassette
+    try:
+        yield cassette
+    finally:
+        active = None
+        if mode == RECORD:
+            cassette.save()
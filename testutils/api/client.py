@@ -13,21 +13,157 @@
 #    limitations under the License.
 import os
 import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import parse_qsl, urlparse
 import warnings
 
 import requests
 
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.exceptions import InsecureRequestWarning
 
+from testutils.api import cassette, http2, metrics
+
 GATEWAY_HOSTNAME = os.environ.get("GATEWAY_HOSTNAME") or "mender-api-gateway"
 
+# Largest page size accepted by the list endpoints of the backend services
+MAX_PER_PAGE = 500
+
+# Maximum number of keep-alive connections kept per host/schema
+POOL_SIZE = int(os.environ.get("API_CLIENT_POOL_SIZE") or 10)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_stats = {"requests": 0, "handshakes": 0, "handshake_time": 0.0}
+_stats_lock = threading.Lock()
+
+
+class _CountingConnectionMixin:
+    """Accounts every (re)connect, i.e. every TCP (and TLS) handshake."""
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            return super().connect()
+        finally:
+            with _stats_lock:
+                _stats["handshakes"] += 1
+                _stats["handshake_time"] += time.monotonic() - start
+
+
+class _CountingHTTPConnection(_CountingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CountingHTTPSConnection(_CountingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class _PooledAdapter(cassette.CassetteAdapterMixin, HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, *args, **kwargs):
+        with _stats_lock:
+            _stats["requests"] += 1
+        return super().send(*args, **kwargs)
+
+
+def new_session(schema="https://", pool_size=None, use_http2=None):
+    """Returns a requests.Session keeping up to pool_size connections alive,
+    or multiplexing its requests over HTTP/2 (see testutils.api.http2)."""
+    session = requests.Session()
+    # Sessions are shared between users and tenants, never carry
+    # cookies over from one call to the next.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.hooks["response"].append(metrics.response_hook)
+    if use_http2 is None:
+        use_http2 = http2.enabled
+    if use_http2 and schema == "https://":
+        session.mount(schema, http2.Http2Adapter())
+    else:
+        session.mount(
+            schema,
+            _PooledAdapter(pool_connections=1, pool_maxsize=pool_size or POOL_SIZE),
+        )
+    return session
+
+
+def get_session(host, schema="https://", pool_size=None):
+    """Returns the requests.Session shared by all the clients targeting
+    the given host/schema with the same pool size, creating it on first
+    use."""
+    pool_size = pool_size or POOL_SIZE
+    key = (schema, host, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = new_session(schema, pool_size)
+            _sessions[key] = session
+        return session
+
+
+def reset_sessions():
+    """Closes all the pooled connections, e.g. after a backend restart."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+    http2.reset_client()
+
+
+def connection_stats():
+    """Returns the number of requests sent through the pooled sessions, how
+    many of them needed a new connection ("handshakes", along with the
+    total time spent connecting) and how many reused a kept-alive one."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["reused"] = stats["requests"] - stats["handshakes"]
+    return stats
+
+
+def reset_connection_stats():
+    with _stats_lock:
+        _stats.update(requests=0, handshakes=0, handshake_time=0.0)
+
 
 class ApiClient:
-    def __init__(self, base_url="", host=GATEWAY_HOSTNAME, schema="https://"):
+    def __init__(
+        self,
+        base_url="",
+        host=GATEWAY_HOSTNAME,
+        schema="https://",
+        pool_size=None,
+    ):
         self.host = host
         self.schema = schema
         self.base_url = schema + host + base_url
         self.headers = {}
+        self.pool_size = pool_size
+
+    @property
+    def session(self):
+        """The pooled session, looked up on every call so that the clients
+        move on to new sessions after reset_sessions()."""
+        return get_session(self.host, self.schema, pool_size=self.pool_size)
 
     def with_auth(self, token):
         return self.with_header("Authorization", "Bearer " + token)
@@ -48,25 +184,89 @@ class ApiClient:
         auth=None,
         files=None,
     ):
-        url = self.__make_url(url)
-        url = self.__subst_path_params(url, path_params)
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=InsecureRequestWarning)
-            return requests.request(
-                method,
-                url,
-                json=body,
-                data=data,
-                params=qs_params,
-                headers=self.__make_headers(headers),
-                auth=auth,
-                verify=False,
-                files=files,
-            )
+        url = self.__subst_path_params(self.__make_url(url), path_params)
+        start = time.monotonic()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=InsecureRequestWarning)
+                return self.session.request(
+                    method,
+                    url,
+                    json=body,
+                    data=data,
+                    params=qs_params,
+                    headers=self.__make_headers(headers),
+                    auth=auth,
+                    verify=False,
+                    files=files,
+                )
+        except requests.RequestException:
+            # The responses are recorded by metrics.response_hook, only the
+            # calls which got none are recorded here
+            metrics.record(method, metrics.template_path(url), time.monotonic() - start)
+            raise
 
     def post(self, url, *pargs, **kwargs):
         return self.call("POST", url, *pargs, **kwargs)
 
+    def paginate(
+        self,
+        url,
+        path_params={},
+        qs_params={},
+        headers={},
+        per_page=MAX_PER_PAGE,
+        prefetch=0,
+    ):
+        """Yields the items of a list endpoint, one page after the other.
+
+        Without prefetch, pages are followed through the "next" Link header.
+        With prefetch=N, the N pages following the one being consumed are
+        requested concurrently; iteration ends at the first short page.
+        """
+        qs_params = dict(qs_params, per_page=per_page)
+        qs_params.setdefault("page", 1)
+
+        def get_page(qs_params):
+            return self.__get_page(url, path_params, qs_params, headers)
+
+        if prefetch <= 0:
+            while True:
+                r, items = get_page(qs_params)
+                yield from items
+                next_link = r.links.get("next")
+                if not items or next_link is None:
+                    break
+                qs_params = dict(
+                    qs_params, **dict(parse_qsl(urlparse(next_link["url"]).query))
+                )
+            return
+
+        page = int(qs_params["page"])
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            pending = []
+            while True:
+                while len(pending) <= prefetch:
+                    qs = dict(qs_params, page=page + len(pending))
+                    pending.append(executor.submit(get_page, qs))
+                _, items = pending.pop(0).result()
+                page += 1
+                yield from items
+                if len(items) < per_page:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def __get_page(self, url, path_params, qs_params, headers):
+        r = self.call(
+            "GET", url, path_params=path_params, qs_params=qs_params, headers=headers
+        )
+        assert r.status_code == 200, r.text
+        return r, r.json()
+
     def __make_url(self, path):
         return os.path.join(
             self.base_url, path if not path.startswith("/") else path[1:]
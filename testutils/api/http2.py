@@ -0,0 +1,195 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Optional HTTP/2 transport for requests sessions.
+
+Requests sent through Http2Adapter are multiplexed over a single TLS
+connection per host and per process (i.e. per xdist worker), shared by all
+the sessions with the same TLS and proxy settings. Connection errors are
+retried according to max_retries, and raised as the requests exceptions
+HTTPAdapter would raise. It requires httpx with HTTP/2 support (pip install
+"httpx[http2]"), and is enabled with API_CLIENT_HTTP2=1.
+"""
+
+import os
+import threading
+import time
+
+import requests
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+from testutils.api.cassette import CassetteAdapterMixin
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+enabled = bool(os.environ.get("API_CLIENT_HTTP2"))
+
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def get_client(verify=False, cert=None, proxy=None):
+    """Returns the httpx.Client shared by all the Http2Adapters sending
+    requests with the given TLS verification, client cert and proxy"""
+    if httpx is None:
+        raise RuntimeError('the HTTP/2 transport requires "httpx[http2]"')
+    key = (verify, cert, proxy)
+    with _client_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = httpx.Client(
+                http2=True, verify=verify, cert=cert, proxy=proxy, timeout=None
+            )
+        return client
+
+
+def reset_client():
+    with _client_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def _timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _requests_error(e, request):
+    """Translates the httpx exception e to the matching requests one, so that
+    the callers' except clauses work the same with both transports."""
+    if isinstance(e, httpx.ConnectTimeout):
+        return requests.ConnectTimeout(e, request=request)
+    if isinstance(e, httpx.TimeoutException):
+        return requests.ReadTimeout(e, request=request)
+    if isinstance(e, httpx.ProxyError):
+        return requests.exceptions.ProxyError(e, request=request)
+    return requests.ConnectionError(e, request=request)
+
+
+class _StreamedBody:
+    """Raw body of a streamed response, read through the httpx response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.buffer = b""
+        self.chunks = None
+
+    def stream(self, amt=65536, decode_content=True):
+        yield from self.response.iter_bytes(amt)
+
+    def read(self, amt=None, decode_content=True):
+        if self.chunks is None:
+            self.chunks = self.response.iter_bytes()
+        while amt is None or len(self.buffer) < amt:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if amt is None:
+            amt = len(self.buffer)
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+    def close(self):
+        self.response.close()
+
+    def release_conn(self):
+        self.response.close()
+
+
+class _Http2Adapter(BaseAdapter):
+    def __init__(self, max_retries=None):
+        super().__init__()
+        self.max_retries = max_retries
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ):
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        # Looked up on every request, so that the adapters of the sessions
+        # still around after reset_client() don't use a closed client
+        client = get_client(
+            verify=verify,
+            cert=cert,
+            proxy=select_proxy(request.url, proxies or {}),
+        )
+        attempt = 0
+        while True:
+            try:
+                r = client.send(
+                    client.build_request(
+                        request.method,
+                        request.url,
+                        headers=dict(request.headers),
+                        content=request.body,
+                        timeout=_timeout(timeout),
+                    ),
+                    stream=stream,
+                )
+            except httpx.TransportError as e:
+                if not self._should_retry(request.method, None, attempt):
+                    raise _requests_error(e, request)
+            else:
+                if not self._should_retry(request.method, r.status_code, attempt):
+                    break
+                r.close()
+            time.sleep(self.max_retries.backoff_factor * (2**attempt))
+            attempt += 1
+        return self._build_response(request, r, stream)
+
+    def _should_retry(self, method, status_code, attempt):
+        """Whether the request is to be sent again after failing with the
+        given status code, or with a connection error (None)"""
+        retry = self.max_retries
+        if retry is None or not retry.total or attempt >= retry.total:
+            return False
+        if retry.allowed_methods and method.upper() not in retry.allowed_methods:
+            return False
+        if status_code is None:
+            return True
+        return status_code in (retry.status_forcelist or ())
+
+    def _build_response(self, request, r, stream):
+        response = Response()
+        response.status_code = r.status_code
+        response.reason = r.reason_phrase
+        response.headers = CaseInsensitiveDict(r.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        if stream:
+            response.raw = _StreamedBody(r)
+        else:
+            response._content = r.content
+            response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        # The clients are shared, see reset_client()
+        pass
+
+
+class Http2Adapter(CassetteAdapterMixin, _Http2Adapter):
+    pass
@@ -0,0 +1,124 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Opt-in per endpoint latency statistics of the API calls made by the tests"""
+
+import json
+import math
+import os
+import re
+import threading
+
+from urllib.parse import urlparse
+
+enabled = bool(os.environ.get("API_METRICS"))
+
+# Path segments which are resource IDs: UUIDs, Mongo ObjectIDs and numbers
+_re_id_segment = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{24}|\d+)$",
+    re.IGNORECASE,
+)
+
+
+def enable(value=True):
+    global enabled
+    enabled = value
+
+
+def template_path(url):
+    """Returns the path of url with the resource IDs replaced by {id}"""
+    segments = urlparse(url).path.split("/")
+    return "/".join(
+        "{id}" if _re_id_segment.match(segment) else segment for segment in segments
+    )
+
+
+def retries_of(response):
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+class Histogram:
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+        self.retries = 0
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+    def summary(self):
+        return {
+            "count": len(self.samples),
+            "errors": self.errors,
+            "retries": self.retries,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": max(self.samples),
+        }
+
+
+class Collector:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, path, elapsed, error=False, retries=0):
+        with self.lock:
+            histogram = self.histograms.setdefault((method, path), Histogram())
+            histogram.samples.append(elapsed)
+            histogram.errors += int(error)
+            histogram.retries += retries
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def summary(self):
+        """Returns {"METHOD /templated/path": {count, errors, retries,
+        p50, p95, p99, max}}, latencies in seconds."""
+        with self.lock:
+            return {
+                "%s %s" % key: histogram.summary()
+                for key, histogram in sorted(self.histograms.items())
+            }
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+session_metrics = Collector()
+test_metrics = Collector()
+
+
+def record(method, path, elapsed, status_code=None, retries=0):
+    """Records one call; status_code is None if no response was received."""
+    if not enabled:
+        return
+    error = status_code is None or status_code >= 500
+    for collector in (session_metrics, test_metrics):
+        collector.record(method.upper(), path, elapsed, error=error, retries=retries)
+
+
+def response_hook(response, *args, **kwargs):
+    """requests response hook recording the calls of a requests.Session"""
+    record(
+        response.request.method,
+        template_path(response.request.url),
+        response.elapsed.total_seconds(),
+        status_code=response.status_code,
+        retries=retries_of(response),
+    )
@@ -11,15 +11,17 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import asyncio
+import base64
 import json
 import logging
 import pytest
 import random
 import time
-import string
 import tempfile
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from typing import List
 
@@ -33,7 +35,9 @@ import testutils.api.inventory as inventory
 import testutils.api.tenantadm as tenantadm
 import testutils.api.useradm as useradm
 import testutils.util.crypto
-from testutils.api.client import ApiClient, GATEWAY_HOSTNAME
+from testutils.util.payloads import random_string
+from testutils.api import async_client
+from testutils.api.client import ApiClient, GATEWAY_HOSTNAME, MAX_PER_PAGE
 from testutils.infra.mongo import MongoClient
 from testutils.infra.cli import CliUseradm, CliTenantadm
 from testutils.infra.device import MenderDevice, MenderDeviceGroup
@@ -56,6 +60,7 @@ def clean_mongo(mongo):
 
 def mongo_cleanup(mongo):
     mongo.cleanup()
+    _device_indexes.clear()
 
 
 class User:
@@ -132,17 +137,12 @@ def create_authset(
     assert r.status_code == 401, r.text
 
     # dev must exist and have *this* aset
-    api_dev = get_device_by_id_data(dauthm, id_data, utoken)
+    index = get_device_index(dauthm, utoken)
+    api_dev = index.get_device(id_data)
     assert api_dev is not None
 
-    aset = [
-        a
-        for a in api_dev["auth_sets"]
-        if testutils.util.crypto.compare_keys(a["pubkey"], pubkey)
-    ]
-    assert len(aset) == 1, str(aset)
-
-    aset = aset[0]
+    aset = index.get_authset(api_dev, pubkey)
+    assert aset is not None, "authset not found by public key"
 
     assert aset["identity_data"] == id_data
     assert aset["status"] == "pending"
@@ -213,31 +213,113 @@ def create_org(
     return tenant
 
 
-def get_device_by_id_data(dauthm, id_data, utoken):
-    page = 0
-    per_page = 20
-    qs_params = {}
-    found = None
-    while True:
-        page = page + 1
-        qs_params["page"] = page
-        qs_params["per_page"] = per_page
-        r = dauthm.with_auth(utoken).call(
-            "GET", deviceauth.URL_MGMT_DEVICES, qs_params=qs_params
+def canonical_id_data(id_data):
+    return json.dumps(id_data, sort_keys=True, separators=(",", ":"))
+
+
+class DeviceIndex:
+    """Devices listed by deviceauth for one tenant, indexed by canonical
+    identity data, and their authsets indexed by public key fingerprint.
+
+    The index is refreshed incrementally: a lookup miss only lists the
+    pages following the last one indexed, and falls back to a full listing
+    if the device is still not found.
+    """
+
+    def __init__(self, dauthm, utoken):
+        self.dauthm = dauthm
+        self.utoken = utoken
+        self.devices = {}
+        self.authsets = {}
+        # First page of the device list which is not fully indexed yet
+        self.page = 1
+
+    def add(self, api_dev):
+        self.devices[canonical_id_data(api_dev["identity_data"])] = api_dev
+        for aset in api_dev["auth_sets"]:
+            fingerprint = testutils.util.crypto.key_fingerprint(aset["pubkey"])
+            self.authsets[(api_dev["id"], fingerprint)] = aset
+
+    def get_device(self, id_data):
+        key = canonical_id_data(id_data)
+        api_dev = self.devices.get(key)
+        if api_dev is not None:
+            # Known device, fetch it again for up-to-date authsets
+            r = self.dauthm.with_auth(self.utoken).call(
+                "GET", deviceauth.URL_DEVICE, path_params={"id": api_dev["id"]}
+            )
+            if r.status_code == 200:
+                self.add(r.json())
+                return self.devices[key]
+            assert r.status_code == 404, r.text
+            del self.devices[key]
+
+        start = self.page
+        if self.refresh(key, start):
+            return self.devices[key]
+        if start > 1 and self.refresh(key, 1):
+            return self.devices[key]
+        return None
+
+    def get_authset(self, api_dev, pubkey):
+        fingerprint = testutils.util.crypto.key_fingerprint(pubkey)
+        return self.authsets.get((api_dev["id"], fingerprint))
+
+    def refresh(self, key=None, page=1, prefetch=0):
+        """Indexes the devices listed from the given page on, stopping early
+        once the device with the canonical identity data `key` is found."""
+        per_page = MAX_PER_PAGE
+        count = 0
+        found = False
+        for api_dev in self.dauthm.with_auth(self.utoken).paginate(
+            deviceauth.URL_MGMT_DEVICES,
+            qs_params={"page": page},
+            per_page=per_page,
+            prefetch=prefetch,
+        ):
+            self.add(api_dev)
+            count += 1
+            if key is not None and canonical_id_data(api_dev["identity_data"]) == key:
+                found = True
+                break
+        self.page = page + count // per_page
+        return found
+
+
+_device_indexes = {}
+
+
+def _token_tenant(utoken):
+    """Returns the tenant ID claim of the user JWT, "" if it has none, or
+    the token itself if it can't be decoded."""
+    try:
+        payload = utoken.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
         )
-        assert r.status_code == 200
-        api_devs = r.json()
+        return claims.get("mender.tenant", "")
+    except (IndexError, ValueError):
+        return utoken
 
-        found = [d for d in api_devs if d["identity_data"] == id_data]
-        if len(found) > 0:
-            break
 
-        if len(api_devs) == 0:
-            break
+def get_device_index(dauthm, utoken):
+    """Returns the DeviceIndex of the tenant of the user token, creating it
+    on first use."""
+    key = (dauthm.base_url, _token_tenant(utoken))
+    index = _device_indexes.get(key)
+    if index is None:
+        index = _device_indexes[key] = DeviceIndex(dauthm, utoken)
+    index.dauthm = dauthm
+    index.utoken = utoken
+    return index
 
-    assert len(found) == 1, "device not found by id data"
 
-    return found[0]
+def get_device_by_id_data(dauthm, id_data, utoken):
+    found = get_device_index(dauthm, utoken).get_device(id_data)
+
+    assert found is not None, "device not found by id data"
+
+    return found
 
 
 def change_authset_status(dauthm, did, aid, status, utoken):
@@ -310,6 +392,129 @@ def make_accepted_device(
     return dev
 
 
+def call_all(client: ApiClient, calls, concurrency: int = 16):
+    """Sends the calls, given as (method, url, call() keyword arguments)
+    tuples, at once and returns their responses in order.
+
+    They go through an AsyncApiClient targeting the same base URL as client
+    if httpx is installed, otherwise through client from `concurrency`
+    threads."""
+    if async_client.httpx is None:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(
+                executor.map(
+                    lambda call: client.call(call[0], call[1], **call[2]), calls
+                )
+            )
+
+    async def send():
+        async with async_client.AsyncApiClient.like(client) as aclient:
+            return await async_client.gather_calls(
+                [aclient.call(method, url, **kwargs) for method, url, kwargs in calls]
+            )
+
+    return asyncio.run(send())
+
+
+def make_pending_devices(
+    dauthd1: ApiClient,
+    dauthm: ApiClient,
+    utoken: str,
+    n: int,
+    tenant_token: str = "",
+    concurrency: int = 16,
+) -> List[Device]:
+    """Create n devices with "pending" status.
+
+    The keys are generated concurrently, the auth requests are sent all at
+    once (see call_all()), and the device list is fetched only once to find
+    out the new devices."""
+    id_datas = [rand_id_data() for _ in range(n)]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        keypairs = list(
+            executor.map(lambda _: testutils.util.crypto.get_keypair_rsa(), range(n))
+        )
+
+    calls = []
+    for id_data, (priv, pub) in zip(id_datas, keypairs):
+        body, sighdr = deviceauth.auth_req(id_data, pub, priv, tenant_token)
+        calls.append(
+            ("POST", deviceauth.URL_AUTH_REQS, {"body": body, "headers": sighdr})
+        )
+    for r in call_all(dauthd1, calls, concurrency):
+        assert r.status_code == 401, r.text
+
+    index = get_device_index(dauthm, utoken)
+    index.refresh(prefetch=4)
+
+    devices = []
+    for id_data, (priv, pub) in zip(id_datas, keypairs):
+        api_dev = index.devices.get(canonical_id_data(id_data))
+        assert api_dev is not None, "device not found by id data"
+        aset = index.get_authset(api_dev, pub)
+        assert aset is not None, "authset not found by public key"
+        assert aset["status"] == "pending"
+
+        dev = Device(api_dev["id"], id_data, pub, tenant_token, privkey=priv)
+        dev.authsets.append(
+            Authset(aset["id"], api_dev["id"], id_data, pub, priv, "pending")
+        )
+        dev.status = "pending"
+        devices.append(dev)
+
+    return devices
+
+
+def make_accepted_devices(
+    dauthd1: ApiClient,
+    dauthm: ApiClient,
+    utoken: str,
+    n: int,
+    tenant_token: str = "",
+    concurrency: int = 16,
+) -> List[Device]:
+    """Create n devices with "accepted" status, and their auth tokens.
+
+    Same as calling make_accepted_device() n times, but the requests are
+    sent all at once (see call_all())."""
+    devices = make_pending_devices(
+        dauthd1, dauthm, utoken, n, tenant_token=tenant_token, concurrency=concurrency
+    )
+
+    calls = [
+        (
+            "PUT",
+            deviceauth.URL_AUTHSET_STATUS,
+            {
+                "body": deviceauth.req_status("accepted"),
+                "path_params": {"did": dev.id, "aid": dev.authsets[0].id},
+                "headers": {"Authorization": "Bearer " + utoken},
+            },
+        )
+        for dev in devices
+    ]
+    for r in call_all(dauthm, calls, concurrency):
+        assert r.status_code == 204, r.text
+
+    calls = []
+    for dev in devices:
+        aset = dev.authsets[0]
+        aset.status = "accepted"
+        body, sighdr = deviceauth.auth_req(
+            aset.id_data, aset.pubkey, aset.privkey, tenant_token
+        )
+        calls.append(
+            ("POST", deviceauth.URL_AUTH_REQS, {"body": body, "headers": sighdr})
+        )
+    for dev, r in zip(devices, call_all(dauthd1, calls, concurrency)):
+        assert r.status_code == 200, r.text
+        dev.token = r.text
+        dev.status = "accepted"
+
+    return devices
+
+
 @contextmanager
 def get_mender_artifact(
     artifact_name="test",
@@ -319,7 +524,7 @@ def get_mender_artifact(
     depends=(),
     provides=(),
 ):
-    data = "".join(random.choices(string.ascii_uppercase + string.digits, k=size))
+    data = random_string(size)
     f = tempfile.NamedTemporaryFile(delete=False)
     f.write(data.encode("utf-8"))
     f.close()
@@ -34,9 +34,16 @@ class DockerComposeBaseNamespace(DockerNamespace):
     )
     BASE_FILES = []
 
+    # docker compose commands which do not change the running containers
+    READ_ONLY_COMMANDS = ("config", "logs", "ps")
+
     def __init__(self, name=None, extra_files=[]):
         DockerNamespace.__init__(self, name)
         self.extra_files = copy.copy(extra_files)
+        self._service_ips = {}
+        # When the containers were last (re)created, which tells apart the
+        # successive environments of the same project
+        self.started_at = None
 
     @property
     def docker_compose_files(self):
@@ -69,7 +76,24 @@ class DockerComposeBaseNamespace(DockerNamespace):
     def get_ip_of_service(self, service, network="mender"):
         """Return a list of IP addresseses of `service`. `service` is the same name as
         present in docker-compose files.
+
+        The addresses are cached until the containers of the namespace are
+        changed through docker compose, see invalidate_service_ips().
         """
+        key = (service, network)
+        if key in self._service_ips:
+            return list(self._service_ips[key])
+
+        ips = self._query_ip_of_service(service, network)
+        if len(ips) > 0:
+            self._service_ips[key] = ips
+        return list(ips)
+
+    def invalidate_service_ips(self):
+        """Forget the cached IP addresses of all the services"""
+        self._service_ips = {}
+
+    def _query_ip_of_service(self, service, network):
         temp = (
             "docker ps -q "
             "--filter label=com.docker.compose.project={project} "
@@ -129,6 +153,7 @@ class DockerComposeBaseNamespace(DockerNamespace):
         cmd = f"up -d --wait --wait-timeout {self.wait_healthy_timeout}"
         if extra_args:
             cmd += f" {extra_args}"
+        self.started_at = time.time()
         return self._docker_compose_cmd(cmd, env=env)
 
     def restart_service(self, service):
@@ -152,6 +177,9 @@ class DockerComposeBaseNamespace(DockerNamespace):
         """
         files_args = "".join([" -f %s" % file for file in self.docker_compose_files])
 
+        if arg_list.split()[0] not in self.READ_ONLY_COMMANDS:
+            self.invalidate_service_ips()
+
         cmd = "docker compose -p %s %s %s" % (self.name, files_args, arg_list)
 
         logger.info("running with: %s" % cmd)
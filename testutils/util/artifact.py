@@ -16,9 +16,13 @@ import io
 import os
 import random
 import tarfile
+import tempfile
 import hashlib
 import json
 
+# Compressed payloads bigger than this are spooled to disk
+PAYLOAD_SPOOL_SIZE = 16 * 1024 * 1024
+
 # Valid state-script states
 _valid_states = (
     "ArtifactInstall_Enter",
@@ -146,13 +150,16 @@ class Artifact:
         self._payloads[filename] = fd
         self._payload_types[filename] = payload_type
 
-    def make(self):
+    def make(self, fileobj=None):
         """
         make compiles the artifact at the current state and returns a
         file object with the raw binary artifact.
-        :returns: artifact (io.BytesIO)
+        :param fileobj: optional file object (opened for reading and
+                        writing) to write the artifact to, instead of
+                        keeping it in memory
+        :returns: artifact (io.BytesIO or fileobj)
         """
-        self._artifact = io.BytesIO()
+        self._artifact = fileobj if fileobj is not None else io.BytesIO()
         self._tarfact = tarfile.open(fileobj=self._artifact, mode="w")
         self._add_version()
         self._initialize_manifest()
@@ -218,7 +225,8 @@ class Artifact:
             size = fd.seek(0, io.SEEK_END)
             fd.seek(0)
 
-            payload_tarbin = io.BytesIO()
+            # Large payloads are spooled to disk rather than kept in memory
+            payload_tarbin = tempfile.SpooledTemporaryFile(max_size=PAYLOAD_SPOOL_SIZE)
             payload_tar = tarfile.open(fileobj=payload_tarbin, mode="w:gz")
             tarhdr = tarfile.TarInfo(os.path.basename(filename))
             tarhdr.size = size
@@ -230,6 +238,7 @@ class Artifact:
             self._compute_checksum(filename, fd)
             payload_tarbin.seek(0)
             self._tarfact.addfile(tarhdr, payload_tarbin)
+            payload_tarbin.close()
 
     def _add_version(self):
         version = {"format": "mender", "version": 3}
@@ -11,7 +11,18 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
-from base64 import b64encode
+import atexit
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+
+from base64 import b64decode, b64encode
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
@@ -29,6 +40,14 @@ EC_CURVE_256 = ec.SECP256R1
 EC_CURVE_384 = ec.SECP384R1
 EC_CURVE_521 = ec.SECP521R1
 
+# Number of keypairs, of all kinds, generated ahead of time. The pool is
+# disabled by default, since the generation competes for CPU with the tests
+KEYPAIR_POOL_SIZE = int(os.getenv("KEYPAIR_POOL_SIZE", "0"))
+# Number of processes generating them
+KEYPAIR_POOL_PROCESSES = int(os.getenv("KEYPAIR_POOL_PROCESSES", "2"))
+# Directory where the keypairs left at exit are kept for the next sessions
+KEYPAIR_CACHE_PATH = os.getenv("KEYPAIR_CACHE")
+
 
 def compare_keys(a, b):
     """
@@ -41,29 +60,204 @@ def compare_keys(a, b):
     return a_b64 == b_b64
 
 
-def get_keypair_rsa(public_exponent=65537, key_size=1024):
-    private_key = rsa.generate_private_key(
-        public_exponent=public_exponent,
-        key_size=key_size,
-        backend=default_backend(),
-    )
+def key_fingerprint(key):
+    """
+    Returns the SHA256 hex digest of the DER structure of a PEM key; two keys
+    have the same fingerprint if and only if compare_keys() holds for them.
+    """
+    b64 = "".join(list(filter(None, key.splitlines()))[1:-1])
+    return hashlib.sha256(b64decode(b64)).hexdigest()
 
-    return keypair_pem(private_key, private_key.public_key())
+
+def get_keypair_rsa(public_exponent=65537, key_size=1024):
+    return keypair_pool.get(("rsa", public_exponent, key_size))
 
 
 def get_keypair_ec(curve):
-    private_key = ec.generate_private_key(
-        curve=curve,
-        backend=default_backend(),
-    )
-    return keypair_pem(private_key, private_key.public_key())
+    # The curve (class or instance) is named by its class, e.g. SECP256R1
+    if isinstance(curve, ec.EllipticCurve):
+        curve = type(curve)
+    return keypair_pool.get(("ec", curve.__name__))
 
 
 def get_keypair_ed():
-    private_key = ed25519.Ed25519PrivateKey.generate()
+    return keypair_pool.get(("ed25519",))
+
+
+def generate_keypair(kind):
+    """Generates a keypair of the given kind: ("rsa", public_exponent,
+    key_size), ("ec", curve class name) or ("ed25519",)."""
+    if kind[0] == "rsa":
+        private_key = rsa.generate_private_key(
+            public_exponent=kind[1],
+            key_size=kind[2],
+            backend=default_backend(),
+        )
+    elif kind[0] == "ec":
+        private_key = ec.generate_private_key(
+            curve=getattr(ec, kind[1])(),
+            backend=default_backend(),
+        )
+    elif kind[0] == "ed25519":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise ValueError("unsupported key kind %s" % (kind,))
     return keypair_pem(private_key, private_key.public_key())
 
 
+def _generate_keypairs(kind, n):
+    return [generate_keypair(kind) for _ in range(n)]
+
+
+class KeypairPool:
+    """
+    Keypairs generated ahead of time by background processes, each of them
+    handed out only once. A kind of keypair starts to be generated in the
+    background once it has been asked for min_demand times, so that one-off
+    kinds don't cost anything, and the pool is refilled as keypairs are
+    taken, up to size keypairs of all kinds. Keypairs are generated on the
+    spot when the pool runs dry.
+
+    If cache_path is set, the keypairs left in the pool at exit are stored
+    there, and used (once) by the next pools before any new one is
+    generated, even by other processes.
+    """
+
+    batch_size = 4
+    min_demand = 2
+
+    def __init__(
+        self,
+        size=KEYPAIR_POOL_SIZE,
+        processes=KEYPAIR_POOL_PROCESSES,
+        cache_path=KEYPAIR_CACHE_PATH,
+    ):
+        self.size = size
+        self.processes = processes
+        self.cache_path = cache_path
+        self.pools = {}
+        self.demand = collections.Counter()
+        # One slot per keypair the pools may hold, shared by all the kinds
+        self.room = threading.Semaphore(max(size, 0))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.executor = None
+
+    def get(self, kind):
+        """Returns a (private key, public key) PEM pair never returned
+        before."""
+        keypair = self._from_cache(kind)
+        if keypair is not None:
+            return keypair
+        if self.size <= 0:
+            return generate_keypair(kind)
+        with self.lock:
+            self.demand[kind] += 1
+            one_off = kind not in self.pools and self.demand[kind] < self.min_demand
+        if one_off:
+            return generate_keypair(kind)
+        try:
+            keypair = self.start(kind).get_nowait()
+        except queue.Empty:
+            return generate_keypair(kind)
+        self.room.release()
+        return keypair
+
+    def start(self, kind):
+        """Starts generating keypairs of the given kind in the background,
+        if it isn't already, and returns their queue."""
+        with self.lock:
+            pool = self.pools.get(kind)
+            if pool is None:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    atexit.register(self.close)
+                pool = self.pools[kind] = queue.Queue()
+                threading.Thread(
+                    target=self._refill, args=(kind, pool), daemon=True
+                ).start()
+            return pool
+
+    def _reserve(self):
+        """Waits for room for one more keypair in the pools, and reserves
+        room for up to batch_size of them. Returns 0 once stopped."""
+        while not self.stopped.is_set():
+            if self.room.acquire(timeout=0.5):
+                reserved = 1
+                while reserved < self.batch_size and self.room.acquire(blocking=False):
+                    reserved += 1
+                return reserved
+        return 0
+
+    def _refill(self, kind, pool):
+        while True:
+            n = self._reserve()
+            if n == 0:
+                return
+            try:
+                keypairs = self.executor.submit(_generate_keypairs, kind, n).result()
+            except Exception:
+                # The pool is being shut down
+                return
+            for keypair in keypairs:
+                pool.put(keypair)
+
+    def _cache_dir(self, kind):
+        return os.path.join(self.cache_path, "-".join(str(k) for k in kind))
+
+    def _from_cache(self, kind):
+        if self.cache_path is None:
+            return None
+        d = self._cache_dir(kind)
+        try:
+            names = os.listdir(d)
+        except FileNotFoundError:
+            return None
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(d, name)
+            claimed = "%s.%d" % (path, os.getpid())
+            try:
+                # Only one process can rename the file, which claims it
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed) as f:
+                keypair = tuple(json.load(f))
+            os.remove(claimed)
+            return keypair
+        return None
+
+    def close(self):
+        """Stops the background generation, and stores the keypairs left
+        in the cache, if any."""
+        self.stopped.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.cache_path is None:
+            return
+        for kind, pool in self.pools.items():
+            d = self._cache_dir(kind)
+            os.makedirs(d, exist_ok=True)
+            while True:
+                try:
+                    keypair = pool.get_nowait()
+                except queue.Empty:
+                    break
+                path = os.path.join(d, "%s.json" % uuid.uuid4())
+                with open(path + ".tmp", "w") as f:
+                    json.dump(keypair, f)
+                os.replace(path + ".tmp", path)
+
+
+keypair_pool = KeypairPool()
+
+
 def keypair_pem(private_key, public_key):
     private_pem = private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
@@ -0,0 +1,123 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import os
+import subprocess
+import tempfile
+
+# debugfs messages which are not errors for the operations of the session:
+# replacing a file that doesn't exist yet, creating a directory that does.
+_ignored_errors = (
+    "debugfs ",
+    "rm: File not found by ext2_lookup",
+    "mkdir: Ext2 directory already exists",
+    "ext2fs_mkdir: Ext2 directory already exists",
+)
+
+
+class DebugfsError(Exception):
+    pass
+
+
+class DebugfsSession:
+    """
+    Batch of reads and writes of files in an ext4 image, applied in order by
+    a single `debugfs -f -` process, so that the filesystem metadata of the
+    image is only read once for the whole batch.
+
+        fs = DebugfsSession(image, writable=True)
+        fs.write("/etc/mender/mender.conf", conf)
+        fs.write("/etc/mender/scripts/Sync_Enter_00", script, mode=0o755)
+        fs.read("/etc/mender/mender.conf")
+        files = fs.run()  # {"/etc/mender/mender.conf": b"..."}
+    """
+
+    def __init__(self, image, writable=False):
+        self.image = image
+        self.writable = writable
+        self.operations = []
+
+    def read(self, path):
+        """Reads the file, which is None in the results if it doesn't
+        exist."""
+        self.operations.append(("read", path, None, None))
+
+    def write(self, path, data, mode=None):
+        """Writes (or replaces) the file with data (str or bytes), with the
+        given permissions if any."""
+        assert self.writable, "the session is read-only"
+        if isinstance(data, str):
+            data = data.encode()
+        self.operations.append(("write", path, data, mode))
+
+    def mkdir(self, path):
+        assert self.writable, "the session is read-only"
+        self.operations.append(("mkdir", path, None, None))
+
+    def remove(self, path):
+        assert self.writable, "the session is read-only"
+        self.operations.append(("rm", path, None, None))
+
+    def run(self):
+        """Applies the pending operations, and returns the contents of the
+        files read, by path."""
+        operations, self.operations = self.operations, []
+        with tempfile.TemporaryDirectory(prefix="debugfs") as d:
+            commands = []
+            reads = {}
+            for i, (op, path, data, mode) in enumerate(operations):
+                local = os.path.join(d, str(i))
+                if op == "read":
+                    commands.append('dump "%s" "%s"' % (path, local))
+                    reads[path] = local
+                elif op == "write":
+                    with open(local, "wb") as f:
+                        f.write(data)
+                    commands.append('rm "%s"' % path)
+                    commands.append('write "%s" "%s"' % (local, path))
+                    if mode is not None:
+                        commands.append('sif "%s" mode 0%o' % (path, 0o100000 | mode))
+                else:
+                    commands.append('%s "%s"' % (op, path))
+
+            result = subprocess.run(
+                ["debugfs"]
+                + (["-w"] if self.writable else [])
+                + ["-f", "-", self.image],
+                input="\n".join(commands + ["close", ""]).encode(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            missing = tuple("%s: File not found" % path for path in reads)
+            errors = [
+                line
+                for line in result.stderr.decode(errors="replace").splitlines()
+                if line.strip()
+                and not line.startswith(_ignored_errors)
+                and not line.startswith(missing)
+            ]
+            if result.returncode != 0 or errors:
+                raise DebugfsError(
+                    "debugfs failed on %s (status %d): %s"
+                    % (self.image, result.returncode, "\n".join(errors))
+                )
+
+            files = {}
+            for path, local in reads.items():
+                if os.path.exists(local):
+                    with open(local, "rb") as f:
+                        files[path] = f.read()
+                else:
+                    files[path] = None
+            return files
@@ -0,0 +1,251 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import filelock
+
+from .debugfs import DebugfsSession
+
+logger = logging.getLogger()
+
+# Variants of the images are cached here, shared by the xdist workers, up to
+# this many bytes of disk space
+IMAGE_VARIANTS_PATH = os.getenv("MENDER_IMAGE_VARIANTS", ".image_variants")
+IMAGE_VARIANTS_SIZE = int(
+    os.getenv("MENDER_IMAGE_VARIANTS_SIZE", str(8 * 1024 * 1024 * 1024))
+)
+
+# ioctl sharing the blocks of a file with another one (reflink)
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+# Variants handed out by this process, held with a shared lock until it exits
+# since the tests keep their path, so that they are never evicted under them
+_in_use = {}
+
+
+def file_digest(path):
+    """sha256 of the file, or of the names, modes and contents of the files
+    in the directory. Memoized as long as the file is not modified."""
+    if os.path.isdir(path):
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                h.update(os.path.relpath(full, path).encode())
+                h.update(b"%o" % os.stat(full).st_mode)
+                h.update(file_digest(full).encode())
+        return h.hexdigest()
+
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(stamp)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _digests_lock:
+            _digests[stamp] = digest
+    return digest
+
+
+def _copy_range(src, dst, offset, length):
+    """Copies length bytes at offset, in the kernel if possible, otherwise
+    leaving holes in place of the zero blocks."""
+    end = offset + length
+    try:
+        while offset < end:
+            copied = os.copy_file_range(src, dst, end - offset, offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+        return
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in (
+            errno.EXDEV,
+            errno.ENOSYS,
+            errno.EINVAL,
+            errno.EOPNOTSUPP,
+        ):
+            raise
+    while offset < end:
+        chunk = os.pread(src, min(COPY_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            break
+        if chunk.count(0) != len(chunk):
+            os.pwrite(dst, chunk, offset)
+        offset += len(chunk)
+
+
+def copy_image(src, dst):
+    """Copies the image, sharing its blocks (reflink) if the filesystem
+    supports it. Otherwise only the data regions are copied, and the holes
+    of sparse images are preserved."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            try:
+                data = os.lseek(fsrc.fileno(), offset, os.SEEK_DATA)
+                hole = os.lseek(fsrc.fileno(), data, os.SEEK_HOLE)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Only a hole is left
+                    break
+                # No hole detection, copy everything that is left
+                data, hole = offset, size
+            _copy_range(fsrc.fileno(), fdst.fileno(), data, hole - data)
+            offset = hole
+        fdst.truncate(size)
+
+
+def image_variant(
+    image, files={}, remove=[], path=IMAGE_VARIANTS_PATH, max_size=IMAGE_VARIANTS_SIZE
+):
+    """Returns a copy of the ext4 image with the given files written (by
+    path, their content or a (content, mode) tuple) and removed.
+
+    The variants are cached by the digest of the image and of the changes,
+    so that identical variants are only made once, even across xdist
+    workers. They are shared, and must not be modified. The least recently
+    used ones are evicted past max_size bytes of disk space, unless a process
+    which got them is still running."""
+    writes = {}
+    for filename, content in files.items():
+        content, mode = content if isinstance(content, tuple) else (content, None)
+        writes[filename] = (
+            content.encode() if isinstance(content, str) else content,
+            mode,
+        )
+
+    changes = hashlib.sha256()
+    changes.update(file_digest(image).encode())
+    for filename, (content, mode) in sorted(writes.items()):
+        changes.update(
+            json.dumps([filename, mode, hashlib.sha256(content).hexdigest()]).encode()
+        )
+    changes.update(json.dumps(sorted(remove)).encode())
+
+    os.makedirs(path, exist_ok=True)
+    base, ext = os.path.splitext(os.path.basename(image))
+    variant = os.path.join(path, "%s-%s%s" % (base, changes.hexdigest()[:16], ext))
+    with filelock.FileLock(variant + ".lock"):
+        if os.path.exists(variant):
+            os.utime(variant)
+            _hold(variant)
+            logger.info("Reusing image variant %s" % variant)
+            return variant
+
+        tmp = "%s.%d.tmp" % (variant, os.getpid())
+        try:
+            copy_image(image, tmp)
+            fs = DebugfsSession(tmp, writable=True)
+            for filename in remove:
+                fs.remove(filename)
+            for filename, (content, mode) in writes.items():
+                fs.write(filename, content, mode=mode)
+            fs.run()
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.replace(tmp, variant)
+        _hold(variant)
+        logger.info("Created image variant %s" % variant)
+    evict_image_variants(path, max_size)
+    return variant
+
+
+def _hold(variant):
+    """Takes a shared lock on the variant, kept until the process exits"""
+    with _digests_lock:
+        if variant in _in_use:
+            return
+        fd = os.open(variant, os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        _in_use[variant] = fd
+
+
+def _held(variant):
+    """Whether a process, this one included, holds the variant"""
+    fd = os.open(variant, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def _remove_orphan_lock(lock):
+    """Removes the lock of a variant which failed to be made"""
+    if os.path.exists(lock[: -len(".lock")]):
+        return
+    try:
+        with filelock.FileLock(lock, timeout=0):
+            if not os.path.exists(lock[: -len(".lock")]):
+                os.remove(lock)
+    except (filelock.Timeout, FileNotFoundError):
+        pass
+
+
+def evict_image_variants(path=IMAGE_VARIANTS_PATH, max_size=IMAGE_VARIANTS_SIZE):
+    """Removes the least recently used variants past max_size bytes of disk
+    space, skipping the ones being made or held by a running process."""
+    with filelock.FileLock(os.path.join(path, "evict.lock")):
+        variants = []
+        for name in os.listdir(path):
+            if name.endswith(".lock") and name != "evict.lock":
+                _remove_orphan_lock(os.path.join(path, name))
+            if name.endswith((".lock", ".tmp")):
+                continue
+            st = os.stat(os.path.join(path, name))
+            variants.append((st.st_mtime, st.st_blocks * 512, name))
+        total = sum(size for _, size, _ in variants)
+        for mtime, size, name in sorted(variants):
+            if total <= max_size:
+                break
+            variant = os.path.join(path, name)
+            try:
+                with filelock.FileLock(variant + ".lock", timeout=0):
+                    if _held(variant):
+                        continue
+                    os.remove(variant)
+                    os.remove(variant + ".lock")
+            except filelock.Timeout:
+                continue
+            logger.info("Evicted image variant %s" % variant)
+            total -= size
@@ -0,0 +1,131 @@
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import io
+import os
+import random
+import string
+
+# Pseudo-random data is generated this many bytes at a time
+BLOCK_SIZE = 1024 * 1024
+
+_alphanumeric = string.ascii_uppercase + string.digits
+
+# Random bytes below the largest multiple of the number of characters are
+# mapped to them, so that all of them are equally likely, and the bytes above
+# are dropped
+_printable_limit = 256 - 256 % len(_alphanumeric)
+_printable_table = bytes(
+    ord(_alphanumeric[i % len(_alphanumeric)]) if i < _printable_limit else 0
+    for i in range(256)
+)
+_printable_drop = bytes(range(_printable_limit, 256))
+
+
+def make_sparse_file(path, size):
+    """Creates a file of size zero bytes without writing them, in no time."""
+    with open(path, "wb") as f:
+        f.truncate(size)
+    return path
+
+
+def random_string(size, seed=None):
+    """Returns size random uppercase letters and digits, all equally likely,
+    made from random bytes in bulk."""
+    rng = random.Random(seed)
+    chunks = []
+    missing = size
+    while missing > 0:
+        # A few of the bytes are dropped, ask for more than needed
+        chunk = rng.randbytes(missing + missing // 16 + 16).translate(
+            _printable_table, _printable_drop
+        )[:missing]
+        chunks.append(chunk)
+        missing -= len(chunk)
+    return b"".join(chunks).decode()
+
+
+class RandomPayload(io.RawIOBase):
+    """
+    Read-only, seekable file of size pseudo-random bytes, which are the same
+    for the same seed, generated block by block as they are read instead of
+    being held in memory. It can be given as is to Artifact.add_payload.
+
+    Every block is generated on its own from the seed and its index, so that
+    the payload doesn't compress, whatever the window size of the compressor.
+    It is not meant to be cryptographically random.
+    """
+
+    def __init__(self, size, seed=0, block_size=BLOCK_SIZE):
+        self.size = size
+        self.seed = seed
+        self.block_size = block_size
+        self.position = 0
+        self._block_index = None
+        self._block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def block(self, index):
+        if index != self._block_index:
+            self._block_index = index
+            self._block = random.Random(self.seed * 2**32 + index).randbytes(
+                self.block_size
+            )
+        return self._block
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        count = 0
+        while count < len(view) and self.position < self.size:
+            index, offset = divmod(self.position, self.block_size)
+            n = min(
+                len(view) - count,
+                self.block_size - offset,
+                self.size - self.position,
+            )
+            view[count : count + n] = self.block(index)[offset : offset + n]
+            count += n
+            self.position += n
+        return count
+
+
+def write_random_file(path, size, seed=0):
+    """Writes size pseudo-random bytes (see RandomPayload) to the file,
+    atomically, without holding them in memory."""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    payload = RandomPayload(size, seed)
+    with open(tmp, "wb") as f:
+        while True:
+            chunk = payload.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+    os.replace(tmp, path)
+    return path